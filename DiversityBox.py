@@ -1,11 +1,27 @@
 import pygame
+import numpy as np
 import random
+import copy
+import multiprocessing
+from multiprocessing import shared_memory
 import os
 import sys
+import time
+import argparse
+import collections
+import functools
 import ctypes
+import mmap
+import queue
+import struct
+
+try:
+    import numba
+except ImportError:
+    numba = None
 
 myappid = 'mycompany.myproduct.subproduct.version'
-ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
+QUICKSAVE_PATH = "quicksave.dbx"
 
 
 def load_image(name, colorkey=None):
@@ -25,12 +41,12 @@ def load_image(name, colorkey=None):
     return image
 
 
-def approximate_color(r, g, b, max_color_modifier):
-    color_modifier = random.randint(max_color_modifier * -1, max_color_modifier + 1)
+def approximate_color(r, g, b, max_color_modifier, rnd=random):
+    color_modifier = rnd.randint(max_color_modifier * -1, max_color_modifier + 1)
     r = 255 if r + color_modifier > 255 else (0 if r + color_modifier < 0 else r + color_modifier)
     g = 255 if g + color_modifier > 255 else (0 if g + color_modifier < 0 else g + color_modifier)
     b = 255 if b + color_modifier > 255 else (0 if b + color_modifier < 0 else b + color_modifier)
-    return [r, g, b]
+    return r, g, b
 
 
 def gradient_color(c1, c2, p):
@@ -39,25 +55,874 @@ def gradient_color(c1, c2, p):
             (c1[2] * p + c2[2] * (100 - p)) // 100)
 
 
+# Таблица материалов для сеточного движка (GridBoard). Код материала - индекс в MATERIAL_TYPES.
+# тип: (класс, вес, прочность, растворимость, можно ли заморозить, шанс затухания, цвет, разброс цвета)
+# Нулевой разброс цвета значит, что цвет у материала постоянный.
+MATERIALS = {
+    "air": ("gas", -10, 0, False, False, 0, (0, 0, 0), 0),
+    "sand": ("falling", 10, 1, False, True, 0, (200, 200, 100), 10),
+    "water": ("liquid", 7, 3, False, False, 0, (30, 30, 200), 10),
+    "iron": ("solid", 20, 3, True, True, 0, (173, 173, 173), 2),
+    "vapor": ("gas", -11, 1, False, False, 0, (222, 222, 222), 3),
+    "fire": ("special", -100, 1, False, False, 0, (222, 89, 22), 0),
+    "acid": ("liquid", 7, 3, False, True, 0, (130, 227, 27), 10),
+    "acid_vapor": ("gas", -11, 1, False, False, 0, (145, 235, 154), 3),
+    "dirt": ("falling", 10, 1, True, True, 0, (105, 39, 10), 5),
+    "oil": ("ignitable_liquid", 6, 1, False, True, 20, (25, 22, 31), 1),
+    "wood": ("ignitable_solid", 20, 2, True, True, 110, (101, 67, 33), 2),
+    "coal": ("ignitable_solid", 20, 2, True, True, 200, (15, 14, 23), 2),
+    "salt": ("falling", 10, 1, True, True, 0, (237, 237, 237), 15),
+    "salt_water": ("liquid", 8, 3, False, True, 0, (84, 92, 176), 10),
+    "ice": ("solid", 20, 2, False, True, 0, (47, 133, 204), 1),
+    "snow": ("falling", 6, 2, False, True, 0, (171, 196, 217), 4),
+    "gunpowder": ("falling", 10, 1, True, True, 0, (36, 37, 38), 3),
+    "explosion_wave": ("special", 20, 1000, False, False, 0, (255, 106, 0), 0),
+    "sawdust": ("ignitable_falling", 10, 1, True, True, 70, (179, 104, 20), 4),
+    "methane": ("gas", -11, 1, False, False, 0, (26, 26, 26), 3),
+    "wick": ("solid", 20, 1, True, True, 0, (7, 61, 19), 4),
+    "liquid_nitrogen": ("liquid", 7, 3, False, False, 0, (210, 236, 247), 10),
+    "nitrogen": ("gas", -11, 1, False, False, 0, (210, 236, 247), 3),
+    "wax": ("solid", 20, 1, True, True, 0, (214, 193, 161), 4),
+    "liquid_wax": ("liquid", 7, 1, True, True, 0, (255, 230, 191), 4),
+    "stone": ("solid", 20, 2, True, True, 0, (55, 63, 67), 4),
+    "strong_fire": ("special", -100, 1, False, False, 0, (30, 144, 255), 0),
+    "lava": ("liquid", 9, 1, False, False, 0, (227, 95, 0), 10),
+    "tnt": ("solid", 20, 1, True, True, 0, (166, 17, 17), 1),
+}
+MATERIAL_TYPES = list(MATERIALS)
+MATERIAL_CODES = {m_type: code for code, m_type in enumerate(MATERIAL_TYPES)}
+MATERIAL_CLASSES = ["gas", "falling", "liquid", "solid", "special", "ignitable_liquid", "ignitable_solid",
+                    "ignitable_falling"]
+
+MAT_CLASS = np.array([MATERIAL_CLASSES.index(MATERIALS[t][0]) for t in MATERIAL_TYPES], dtype=np.uint8)
+MAT_WEIGHT = np.array([MATERIALS[t][1] for t in MATERIAL_TYPES], dtype=np.int16)
+MAT_DURABILITY = np.array([MATERIALS[t][2] for t in MATERIAL_TYPES], dtype=np.int16)
+MAT_SOLUBLE = np.array([MATERIALS[t][3] for t in MATERIAL_TYPES], dtype=bool)
+MAT_CAN_BE_FREEZED = np.array([MATERIALS[t][4] for t in MATERIAL_TYPES], dtype=bool)
+MAT_EXTINCT_CHANCE = np.array([MATERIALS[t][5] for t in MATERIAL_TYPES], dtype=np.int32)
+MAT_COLOR = np.array([MATERIALS[t][6] for t in MATERIAL_TYPES], dtype=np.int16)
+MAT_COLOR_MODIFIER = np.array([MATERIALS[t][7] for t in MATERIAL_TYPES], dtype=np.int16)
+# как двигается класс вещества: 1 - падает вниз, 2 - течет (вниз, по диагонали, в стороны)
+PHYSICS_MOBILITY = {"falling": 1, "ignitable_falling": 1, "liquid": 2, "gas": 2, "ignitable_liquid": 2}
+MAT_MOBILITY = np.array([PHYSICS_MOBILITY.get(MATERIALS[t][0], 0) for t in MATERIAL_TYPES], dtype=np.int8)
+# материалы, которые могут измениться сами по себе, даже если вокруг ничего не происходит.
+# Чанк с ними не засыпает (см. Board.tick_board)
+RESTLESS_TYPES = ("vapor", "acid_vapor", "fire", "strong_fire", "acid", "explosion_wave", "liquid_nitrogen",
+                  "nitrogen", "liquid_wax", "lava", "salt", "ice")
+
+# material_id (как в generate_material) -> (тип, температура, сила взрыва, радиус взрыва)
+GRID_SPAWNS = {"fire_4": ("fire", 4, 0, 0), "fire_5": ("fire", 5, 0, 0), "strong_fire": ("strong_fire", 5, 0, 0),
+               "explosion_wave_gp": ("explosion_wave", 0, 4, 4),
+               "explosion_wave_5_5": ("explosion_wave", 0, 5, 5),
+               "explosion_wave_tnt": ("explosion_wave", 0, 5, 6)}
+# дальше этого ни один взрыв не достает
+BLAST_REACH = max(spawn[3] for spawn in GRID_SPAWNS.values())
+
+# Тепло клетки (поле heat) - отклонение от комнатной температуры: 0 - комната, к ней все и остывает.
+# Источники держат свою температуру, пока существуют; горящее греет как BURNING_HEAT.
+HEAT_SOURCES = {"fire": 1500, "strong_fire": 2500, "lava": 1200, "explosion_wave": 1500, "liquid_nitrogen": -3000,
+                "nitrogen": -300}
+BURNING_HEAT = 1000
+# доля разницы со средним теплом четырех соседей, которую клетка забирает за тик (по умолчанию - 0.25)
+HEAT_CONDUCTIVITY = {"air": 0.15, "vapor": 0.15, "acid_vapor": 0.15, "methane": 0.15, "nitrogen": 0.15,
+                     "iron": 0.6, "water": 0.3, "salt_water": 0.3, "lava": 0.5, "stone": 0.3}
+# доля тепла, которую клетка теряет за тик
+HEAT_LOSS = 1 / 16
+# переходы по теплу: (материал, выше порога (иначе ниже), порог, шанс, во что превращается); шанс - как в
+# REACTION_RULES. Клетка проверяется по теплу после теплопроводности, так что и источник (лава) может остыть;
+# порог лавы ниже нуля, иначе она остывала бы в камень просто от соседства с воздухом
+HEAT_TRANSITIONS = [
+    ("water", True, 100, 0, "vapor"),
+    ("acid", True, 100, 0, "acid_vapor"),
+    ("ice", True, 40, 0, "water"),
+    ("snow", True, 40, 0, "water"),
+    ("wax", True, 60, 0, "liquid_wax"),
+    ("stone", True, 400, 45, "lava"),
+    ("water", False, -100, 0, "ice"),
+    ("salt_water", False, -150, 0, "ice"),
+    ("liquid_wax", False, -100, 0, "wax"),
+    ("lava", False, 0, 0, "stone"),
+]
+MAT_HEAT = np.array([HEAT_SOURCES.get(t, 0) for t in MATERIAL_TYPES], dtype=np.int16)
+MAT_HEAT_SOURCE = np.array([t in HEAT_SOURCES for t in MATERIAL_TYPES], dtype=bool)
+MAT_CONDUCTIVITY = np.array([HEAT_CONDUCTIVITY.get(t, 0.25) for t in MATERIAL_TYPES], dtype=np.float32)
+# горючие материалы греют, пока горят; HEAT_TYPES - все, из-за чего окно может нагреться
+BURNING_TYPES = ("oil", "wood", "coal", "sawdust")
+HEAT_TYPES = set(HEAT_SOURCES) | set(BURNING_TYPES)
+
+# Правила реакций: (источник, сосед, шанс) -> (чем станет источник, чем станет сосед).
+# Источник - материал или действие, которое клетки передают соседям во время тика (очереди ACTION_PHASES).
+# Шанс n значит "1 из n + 1", как randint(0, n) == 0, то есть 0 - всегда. None в результате - клетка не меняется.
+# Сосед None - правило про саму клетку, оно проверяется каждый тик.
+REACTION_RULES = [
+    ("vapor", None, 50, "water", None),
+    ("acid_vapor", None, 35, "acid", None),
+    ("liquid_nitrogen", None, 110, "nitrogen", None),
+    ("nitrogen", None, 10, "air", None),
+    ("fire", "gunpowder", 0, None, "explosion_wave_gp"),
+    ("fire", "tnt", 0, None, "explosion_wave_tnt"),
+    ("fire", "methane", 0, None, "fire_5"),
+    ("lava", "air", 120, None, "fire_4"),
+    ("fire_on_burning", "air", 20, None, "fire_4"),
+    ("salt", "water", 0, None, "salt_water"),
+    ("ice", "water", 50, None, "ice"),
+    ("ice", "vapor", 15, None, "snow"),
+    ("freeze", "fire", 0, None, "air"),
+    # лава держит свое тепло, через теплопроводность ее остужает только очень сильный холод,
+    # поэтому жидкий азот, как и раньше, застужает соседнюю лаву напрямую
+    ("freeze", "lava", 0, None, "stone"),
+] + [("acid", m_type, 35, "air", "air") for m_type, material in MATERIALS.items() if material[3]]
+
+
+def compile_reactions(rules):
+    # правила -> для каждого источника список по коду соседа: (шанс, чем станет источник, чем станет сосед)
+    # или None. Правила про саму клетку лежат под источником "self", клетка в них сама себе сосед
+    reactions = {}
+    for source, target, chance, new_source, new_target in rules:
+        if target is None:
+            source, target, new_source, new_target = "self", source, None, new_source
+        reactions.setdefault(source, [None] * len(MATERIAL_TYPES))[MATERIAL_CODES[target]] = \
+            (chance, new_source, new_target)
+    return reactions
+
+
+REACTIONS = compile_reactions(REACTION_RULES)
+# шансы тех же правил массивами для GridBoard, -1 - правила нет
+REACTION_CHANCES = {source: np.array([-1 if rule is None else rule[0] for rule in rules], dtype=np.int16)
+                    for source, rules in REACTIONS.items()}
+# очереди отложенных действий тика в порядке применения
+ACTION_PHASES = ("fire", "lava", "fire_on_burning", "fade", "salt", "ice", "freeze")
+
+# Поля клетки в сеточном движке: (имя, тип данных, дополнительные измерения)
+GRID_FIELDS = (("mat", np.uint8, ()), ("weight", np.int16, ()), ("temperature", np.int16, ()),
+               ("life_tick", np.int8, ()), ("power", np.int16, ()), ("range", np.int16, ()),
+               ("burning", bool, ()), ("freezed", bool, ()), ("activated", bool, ()),
+               ("color", np.uint8, (3,)), ("original_color", np.uint8, (3,)), ("heat", np.int16, ()))
+
+# Снимок поля (Board.save / Board.load): заголовок, имена материалов (коды материалов в файле - их номера
+# в этом списке), описания полей (имя, тип numpy, значений на клетку) и сами поля GRID_FIELDS подряд,
+# каждое с границы SNAPSHOT_ALIGN байт
+SNAPSHOT_MAGIC = b"DBOX"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = "<4sHIIHH"
+SNAPSHOT_MATERIAL = "24s"
+SNAPSHOT_FIELD = "<16s8sH"
+SNAPSHOT_ALIGN = 64
+# журнал ввода: заголовок, таблица имен материалов кисти, затем записи (тик, действие, x, y, материал, кисть)
+JOURNAL_MAGIC = b"DBXJ"
+JOURNAL_VERSION = 2
+JOURNAL_HEADER = "<4sHq8sIIBIIIHI"
+JOURNAL_RECORD = "<IBhhBB"
+JOURNAL_ACTIONS = ("paint", "clear", "pause", "physics", "features", "camera")
+
+NEIGHBORS_OFFSETS = [(0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)]
+# соседство с ними гасит горящее и мешает загореться
+WET_TYPES = {"water", "vapor", "salt_water", "liquid_nitrogen"}
+
+
+def physics_moves(weight, mobility, rng):
+    # Пакетный шаг физики для всего поля сразу. Сначала каждая клетка выбирает ход (вниз, по диагонали, в
+    # сторону) по весам соседей, потом ходы раздаются по очереди: вниз, диагонали, стороны. Клетка участвует
+    # максимум в одной перестановке, поэтому из двух претендентов на одну клетку проходит только первый.
+    # Возвращает перестановку индексов клеток (или None, если никто не двигается).
+    # Случайные числа берутся здесь, а не в ядрах, так что ядра любого бэкенда делают одно и то же.
+    coin = rng.random(weight.shape) < 0.5
+    moves = KERNELS["choose_moves"](weight, mobility, coin)
+    if not moves.any():
+        return None
+    orders = np.array([rng.permutation(2) for _ in range(len(MOVE_STEPS[0]))])
+    return KERNELS["apply_moves"](moves, coin[0, 0], orders)
+
+
+# порядок раздачи ходов (код хода, dy, dx): вниз, диагонали, стороны; второй вариант - если coin[0, 0]
+MOVE_STEPS = np.array([[(1, 1, 0), (2, 1, -1), (3, 1, 1), (4, 0, -1), (5, 0, 1)],
+                       [(1, 1, 0), (3, 1, 1), (2, 1, -1), (5, 0, 1), (4, 0, -1)]])
+
+
+def choose_moves(weight, mobility, coin):
+    # ход каждой клетки: 1 - вниз, 2 и 3 - по диагонали влево и вправо, 4 и 5 - в сторону, 0 - стоит
+    h, w = weight.shape
+    flowing = mobility == 2
+    moves = np.zeros((h, w), dtype=np.int8)
+    down = np.zeros((h, w), dtype=bool)
+    down[:-1] = weight[:-1] > weight[1:]
+    moves[down & (mobility != 0)] = 1
+
+    flow = flowing & ~down
+    left, right = np.zeros((h, w), dtype=bool), np.zeros((h, w), dtype=bool)
+    left[:-1, 1:] = weight[:-1, 1:] > weight[1:, :-1]
+    right[:-1, :-1] = weight[:-1, :-1] > weight[1:, 1:]
+    left &= flow
+    right &= flow
+    moves[left & (~right | coin)] = 2
+    moves[right & (~left | ~coin)] = 3
+
+    flow &= ~left & ~right
+    left, right = np.zeros((h, w), dtype=bool), np.zeros((h, w), dtype=bool)
+    left[:, 1:] = weight[:, :-1] < weight[:, 1:]
+    right[:, :-1] = weight[:, 1:] < weight[:, :-1]
+    left &= flow
+    right &= flow
+    moves[left & (~right | coin)] = 4
+    moves[right & (~left | ~coin)] = 5
+    return moves
+
+
+def apply_moves(moves, first, orders):
+    # раздача ходов в порядке MOVE_STEPS[first]; orders[k] - в каком порядке идут четности k-го шага
+    h, w = moves.shape
+    perm = np.arange(h * w).reshape(h, w)
+    taken = np.zeros((h, w), dtype=bool)
+    rows, cols = np.indices((h, w))
+    for k, (code, dy, dx) in enumerate(MOVE_STEPS[int(first)]):
+        # за один проход берем только четные или только нечетные строки (столбцы для ходов в сторону),
+        # так источники и цели одного прохода не пересекаются
+        parity = rows if dy else cols
+        for p in orders[k]:
+            src = (moves == code) & ~taken & (parity % 2 == p)
+            cells = (slice(0, h - dy), slice(max(0, -dx), w - max(0, dx)))
+            targets = (slice(dy, h), slice(max(0, dx), w - max(0, -dx)))
+            ok = src[cells] & ~taken[targets]
+            if not ok.any():
+                continue
+            a, b = perm[cells][ok], perm[targets][ok]
+            perm[cells][ok], perm[targets][ok] = b, a
+            taken[cells] |= ok
+            taken[targets] |= ok
+    return perm
+
+
+def choose_moves_loops(weight, mobility, coin):
+    # то же, что choose_moves, циклом по клеткам (для numba)
+    h, w = weight.shape
+    moves = np.zeros((h, w), dtype=np.int8)
+    for y in range(h):
+        for x in range(w):
+            if y + 1 < h and weight[y, x] > weight[y + 1, x]:
+                if mobility[y, x] != 0:
+                    moves[y, x] = 1
+                continue
+            if mobility[y, x] != 2:
+                continue
+            left = y + 1 < h and x > 0 and weight[y, x] > weight[y + 1, x - 1]
+            right = y + 1 < h and x + 1 < w and weight[y, x] > weight[y + 1, x + 1]
+            code = 2
+            if not left and not right:
+                left = x > 0 and weight[y, x - 1] < weight[y, x]
+                right = x + 1 < w and weight[y, x + 1] < weight[y, x]
+                code = 4
+            if left and (not right or coin[y, x]):
+                moves[y, x] = code
+            elif right and (not left or not coin[y, x]):
+                moves[y, x] = code + 1
+    return moves
+
+
+def apply_moves_loops(moves, first, orders):
+    # то же, что apply_moves, циклом по клеткам (для numba)
+    h, w = moves.shape
+    perm = np.arange(h * w).reshape(h, w)
+    taken = np.zeros((h, w), dtype=np.bool_)
+    steps = MOVE_STEPS[1] if first else MOVE_STEPS[0]
+    for k in range(len(steps)):
+        code, dy, dx = steps[k, 0], steps[k, 1], steps[k, 2]
+        for p in orders[k]:
+            for y in range(h - dy):
+                for x in range(max(0, -dx), w - max(0, dx)):
+                    if (y if dy else x) % 2 != p or moves[y, x] != code or taken[y, x] or taken[y + dy, x + dx]:
+                        continue
+                    perm[y, x], perm[y + dy, x + dx] = perm[y + dy, x + dx], perm[y, x]
+                    taken[y, x] = True
+                    taken[y + dy, x + dx] = True
+    return perm
+
+
+def dilate(mask):
+    # клетки маски вместе со всеми их соседями
+    result = mask.copy()
+    result[1:] |= mask[:-1]
+    result[:-1] |= mask[1:]
+    rows = result.copy()
+    result[:, 1:] |= rows[:, :-1]
+    result[:, :-1] |= rows[:, 1:]
+    return result
+
+
+def blast_rings(durability, power, wave_range):
+    # Взрывы по маскам. Волна из клетки с силой p и радиусом r > 0 переходит в соседа, если его прочность
+    # не больше p, и у соседа остаются сила p - 1 и радиус r - 1. Все источники (power > 0) считаются
+    # одновременно, кольцо за кольцом; если в клетку приходят две волны, берется сильнейшая.
+    # Возвращает маску задетых клеток (вместе с источниками) и радиус, оставшийся в каждой из них.
+    return KERNELS["spread_blasts"](durability, power, wave_range)
+
+
+def spread_blasts(durability, power, wave_range):
+    h, w = durability.shape
+    reached = power > 0
+    power = np.where(reached, power, 0).astype(np.int16)
+    wave_range = np.where(reached, wave_range, 0).astype(np.int16)
+    front = reached & (wave_range > 0)
+    while front.any():
+        front_power = np.where(front, power, np.iinfo(np.int16).min).astype(np.int16)
+        front_range = np.where(front, wave_range, 0).astype(np.int16)
+        best_power = np.full((h, w), np.iinfo(np.int16).min, dtype=np.int16)
+        best_range = np.zeros((h, w), dtype=np.int16)
+        for dy, dx in NEIGHBORS_OFFSETS:
+            cells = slice(max(0, dy), h + min(0, dy)), slice(max(0, dx), w + min(0, dx))
+            neighbors = slice(max(0, -dy), h + min(0, -dy)), slice(max(0, -dx), w + min(0, -dx))
+            np.maximum(best_power[cells], front_power[neighbors], out=best_power[cells])
+            np.maximum(best_range[cells], front_range[neighbors], out=best_range[cells])
+        hit = ~reached & (best_range > 0) & (durability <= best_power)
+        power[hit] = best_power[hit] - 1
+        wave_range[hit] = best_range[hit] - 1
+        reached |= hit
+        front = hit & (wave_range > 0)
+    return reached, wave_range
+
+
+def spread_blasts_loops(durability, power, wave_range):
+    # то же, что spread_blasts, циклом (для numba): кольцо считается только от клеток фронта, а не по всему полю
+    h, w = durability.shape
+    reached = power > 0
+    power = np.where(reached, power, 0).astype(np.int16)
+    wave_range = np.where(reached, wave_range, 0).astype(np.int16)
+    best_power = np.full((h, w), -32768, dtype=np.int16)
+    best_range = np.zeros((h, w), dtype=np.int16)
+    touched = np.zeros((h, w), dtype=np.bool_)
+    front = np.empty((h * w, 2), dtype=np.int64)
+    near = np.empty((h * w, 2), dtype=np.int64)
+    fronts = 0
+    for y in range(h):
+        for x in range(w):
+            if reached[y, x] and wave_range[y, x] > 0:
+                front[fronts, 0], front[fronts, 1] = y, x
+                fronts += 1
+    while fronts:
+        # соседи фронта берут сильнейшую из пришедших волн
+        nears = 0
+        for k in range(fronts):
+            y, x = front[k, 0], front[k, 1]
+            for ny in range(max(0, y - 1), min(h, y + 2)):
+                for nx in range(max(0, x - 1), min(w, x + 2)):
+                    if reached[ny, nx]:
+                        continue
+                    if not touched[ny, nx]:
+                        touched[ny, nx] = True
+                        near[nears, 0], near[nears, 1] = ny, nx
+                        nears += 1
+                    best_power[ny, nx] = max(best_power[ny, nx], power[y, x])
+                    best_range[ny, nx] = max(best_range[ny, nx], wave_range[y, x])
+        fronts = 0
+        for k in range(nears):
+            y, x = near[k, 0], near[k, 1]
+            if durability[y, x] <= best_power[y, x]:
+                power[y, x] = best_power[y, x] - 1
+                wave_range[y, x] = best_range[y, x] - 1
+                reached[y, x] = True
+                if wave_range[y, x] > 0:
+                    front[fronts, 0], front[fronts, 1] = y, x
+                    fronts += 1
+            touched[y, x] = False
+            best_power[y, x] = -32768
+            best_range[y, x] = 0
+    return reached, wave_range
+
+
+def conduct_heat(heat, codes):
+    # Шаг теплопроводности: клетка забирает долю MAT_CONDUCTIVITY своего материала от разницы со средним
+    # теплом четырех соседей и теряет HEAT_LOSS тепла. Возвращает новое тепло (float32) для всех клеток;
+    # при записи в поле дробная часть отбрасывается, так что остывание доходит до нуля
+    return KERNELS["diffuse"](heat.astype(np.float32), MAT_CONDUCTIVITY[codes], np.float32(1 - HEAT_LOSS))
+
+
+def diffuse(heat, conductivity, keep):
+    # соседи складываются в порядке: слева, сверху, справа, снизу (как и в diffuse_loops)
+    h, w = heat.shape
+    total = np.zeros((h, w), dtype=np.float32)
+    count = np.zeros((h, w), dtype=np.float32)
+    for dy, dx in ((0, 1), (1, 0), (0, -1), (-1, 0)):
+        cells = slice(max(0, dy), h + min(0, dy)), slice(max(0, dx), w + min(0, dx))
+        neighbors = slice(max(0, -dy), h + min(0, -dy)), slice(max(0, -dx), w + min(0, -dx))
+        total[cells] += heat[neighbors]
+        count[cells] += 1
+    heat += conductivity * (total / count - heat)
+    heat *= keep
+    return heat
+
+
+def diffuse_loops(heat, conductivity, keep):
+    # то же, что diffuse, циклом по клеткам (для numba); все вычисления во float32, как у numpy
+    h, w = heat.shape
+    result = np.empty_like(heat)
+    for y in range(h):
+        for x in range(w):
+            total = np.float32(0)
+            count = 0
+            if x > 0:
+                total += heat[y, x - 1]
+                count += 1
+            if y > 0:
+                total += heat[y - 1, x]
+                count += 1
+            if x + 1 < w:
+                total += heat[y, x + 1]
+                count += 1
+            if y + 1 < h:
+                total += heat[y + 1, x]
+                count += 1
+            value = heat[y, x] + conductivity[y, x] * (total / np.float32(count) - heat[y, x])
+            result[y, x] = value * keep
+    return result
+
+
+def pin_heat(heat, codes, burning):
+    # источники перед теплопроводностью возвращают себе свою температуру
+    heat = np.where(MAT_HEAT_SOURCE[codes], MAT_HEAT[codes], heat)
+    if burning is not None:
+        heat = np.where(burning, np.maximum(heat, BURNING_HEAT), heat)
+    return heat
+
+
+def heat_box(active, margin=2):
+    # Прямоугольник (y0, y1, x0, x1) вокруг клеток active (источники и нагретые) с отступом margin или None.
+    # Клетки дальше двух от нагретых остаются холодными, так что тепло в прямоугольнике считается так же,
+    # как по всему окну
+    rows = np.flatnonzero(active.any(axis=1))
+    if not rows.size:
+        return None
+    cols = np.flatnonzero(active.any(axis=0))
+    h, w = active.shape
+    return (max(0, rows[0] - margin), min(h, rows[-1] + margin + 1),
+            max(0, cols[0] - margin), min(w, cols[-1] + margin + 1))
+
+
+# Ядра тика - числовые циклы по клеткам. У каждого два исполнения: эталонное на numpy (бэкенд "numpy")
+# и циклом по клеткам (*_loops), который numba компилирует в машинный код (бэкенд "numba"). Случайные
+# числа ядрам передаются готовыми, так что с одним seed оба бэкенда дают одно и то же поле
+# (проверка - python benchmark.py kernels). Бэкенд "loops" - те же циклы без компиляции, только для проверки.
+KERNEL_NAMES = ("choose_moves", "apply_moves", "spread_blasts", "diffuse")
+KERNEL_BACKENDS = ("auto", "numpy", "numba", "loops")
+KERNELS = {}
+kernel_backend = None
+
+
+def set_kernels(backend):
+    # выбор бэкенда при запуске: "auto" - numba, если она установлена; без numba остается numpy
+    global kernel_backend
+    if backend == "auto":
+        backend = "numpy" if numba is None else "numba"
+    elif backend == "numba" and numba is None:
+        print("numba не установлена, ядра тика остаются на numpy", file=sys.stderr)
+        backend = "numpy"
+    for name in KERNEL_NAMES:
+        kernel = globals()[name if backend == "numpy" else name + "_loops"]
+        KERNELS[name] = numba.njit(cache=True)(kernel) if backend == "numba" else kernel
+    kernel_backend = backend
+    return backend
+
+
+set_kernels("numpy")
+
+
+@functools.lru_cache(maxsize=1)
+def neighbor_table(height, width):
+    # для каждой клетки поля - кортеж координат ее соседей в порядке NEIGHBORS_OFFSETS. Таблица строится
+    # один раз на размер поля, сами координаты - общие кортежи, так что поиск соседей ничего не создает.
+    # Хранится только таблица последнего размера: у поля 1024x1024 она весит сотни мегабайт
+    cells = [[(y, x) for x in range(width)] for y in range(height)]
+    return [[tuple(cells[y + dy][x + dx] for dy, dx in NEIGHBORS_OFFSETS
+                   if 0 <= y + dy < height and 0 <= x + dx < width)
+             for x in range(width)] for y in range(height)]
+
+
+def write_snapshot(path, height, width, fields):
+    # файл пишется рядом и подменяет старый целиком: старый может быть открыт через mmap
+    head = struct.pack(SNAPSHOT_HEADER, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, height, width, len(MATERIAL_TYPES),
+                       len(GRID_FIELDS))
+    head += b"".join(struct.pack(SNAPSHOT_MATERIAL, m_type.encode()) for m_type in MATERIAL_TYPES)
+    head += b"".join(struct.pack(SNAPSHOT_FIELD, name.encode(), np.dtype(dtype).str.encode(), int(np.prod(dims)))
+                     for name, dtype, dims in GRID_FIELDS)
+    with open(path + ".tmp", "wb") as file:
+        file.write(head)
+        for name, dtype, dims in GRID_FIELDS:
+            file.write(bytes(-file.tell() % SNAPSHOT_ALIGN))
+            np.ascontiguousarray(fields[name], dtype=dtype).tofile(file)
+    os.replace(path + ".tmp", path)
+
+
+def read_snapshot(path):
+    # Поля снимка без чтения файла: массивы смотрят прямо в отображенный в память файл (копирование при записи,
+    # так что поле можно менять, а файл останется прежним). Страницы подгружаются, когда к ним обращаются.
+    with open(path, "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    magic, version, height, width, materials, count = struct.unpack_from(SNAPSHOT_HEADER, data)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(f"{path}: это не снимок поля DiversityBox версии {SNAPSHOT_VERSION}")
+    offset = struct.calcsize(SNAPSHOT_HEADER)
+    names = []
+    for _ in range(materials):
+        names.append(struct.unpack_from(SNAPSHOT_MATERIAL, data, offset)[0].rstrip(b"\0").decode())
+        offset += struct.calcsize(SNAPSHOT_MATERIAL)
+    stored = {}
+    for _ in range(count):
+        name, dtype, size = struct.unpack_from(SNAPSHOT_FIELD, data, offset)
+        stored[name.rstrip(b"\0").decode()] = (np.dtype(dtype.rstrip(b"\0").decode()), size)
+        offset += struct.calcsize(SNAPSHOT_FIELD)
+    fields = {}
+    for name, (dtype, size) in stored.items():
+        offset += -offset % SNAPSHOT_ALIGN
+        field = np.frombuffer(data, dtype=dtype, count=height * width * size, offset=offset)
+        fields[name] = field.reshape((height, width) + ((size,) if size > 1 else ()))
+        offset += field.nbytes
+    for name, dtype, dims in GRID_FIELDS:
+        if name not in fields:
+            fields[name] = np.zeros((height, width) + dims, dtype=dtype)
+        elif fields[name].dtype != dtype:
+            fields[name] = fields[name].astype(dtype)
+    if names != MATERIAL_TYPES:
+        # список материалов с тех пор поменялся - коды переводятся по именам
+        unknown = set(names) - set(MATERIAL_CODES)
+        if unknown:
+            raise ValueError(f"{path}: неизвестные материалы {', '.join(sorted(unknown))}")
+        fields["mat"] = np.array([MATERIAL_CODES[name] for name in names], dtype=np.uint8)[fields["mat"]]
+    return height, width, fields
+
+
+def write_journal(path, header, journal):
+    materials = sorted({material for tick, action, cell, material, brush in journal})
+    head = struct.pack(JOURNAL_HEADER, JOURNAL_MAGIC, JOURNAL_VERSION, -1 if header["seed"] is None else header["seed"],
+                       header["engine"].encode(), header["width"], header["height"], header["workers"],
+                       header["ticks"], header["view_width"], header["view_height"], len(materials), len(journal))
+    head += b"".join(struct.pack(SNAPSHOT_MATERIAL, material.encode()) for material in materials)
+    with open(path, "wb") as file:
+        file.write(head)
+        file.write(b"".join(struct.pack(JOURNAL_RECORD, tick, JOURNAL_ACTIONS.index(action), cell[0], cell[1],
+                                        materials.index(material), brush)
+                            for tick, action, cell, material, brush in journal))
+
+
+def read_journal(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    magic, version, seed, engine, width, height, workers, ticks, view_width, view_height, materials, count = \
+        struct.unpack_from(JOURNAL_HEADER, data)
+    if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION:
+        raise ValueError(f"{path}: это не журнал ввода DiversityBox версии {JOURNAL_VERSION}")
+    offset = struct.calcsize(JOURNAL_HEADER)
+    names = []
+    for _ in range(materials):
+        names.append(struct.unpack_from(SNAPSHOT_MATERIAL, data, offset)[0].rstrip(b"\0").decode())
+        offset += struct.calcsize(SNAPSHOT_MATERIAL)
+    journal = [(tick, JOURNAL_ACTIONS[action], (x, y), names[material], brush)
+               for tick, action, x, y, material, brush in struct.iter_unpack(JOURNAL_RECORD, data[offset:])]
+    if len(journal) != count:
+        raise ValueError(f"{path}: журнал обрезан ({len(journal)} записей из {count})")
+    header = {"seed": None if seed < 0 else seed, "engine": engine.rstrip(b"\0").decode(), "width": width,
+              "height": height, "workers": workers, "ticks": ticks, "view_width": view_width,
+              "view_height": view_height}
+    return header, journal
+
+
+def material_table(*types):
+    table = np.zeros(len(MATERIAL_TYPES), dtype=bool)
+    for m_type in types:
+        table[MATERIAL_CODES[m_type]] = True
+    return table
+
+
+class TickRandom:
+    # Случайные числа для правил поля с тем же интерфейсом, что у модуля random (randint, choice, shuffle).
+    # Числа вытягиваются из генератора numpy поля одной пачкой в начале тика (new_tick), а правила просто
+    # берут следующее число из готового списка. Размер пачки подстраивается под расход прошлого тика,
+    # поэтому при одном и том же seed и одних и тех же действиях поле меняется одинаково.
+    def __init__(self, rng):
+        self.rng = rng
+        self.batch = 256
+        self.numbers = []
+        self.position = 0
+        self.used = 0
+
+    def new_tick(self):
+        self.batch = max(256, self.used)
+        self.used = 0
+        self.refill()
+
+    def refill(self):
+        self.numbers = self.rng.random(self.batch).tolist()
+        self.position = 0
+
+    def random(self):
+        if self.position == len(self.numbers):
+            self.refill()
+        self.position += 1
+        self.used += 1
+        return self.numbers[self.position - 1]
+
+    def randint(self, a, b):
+        return a + int(self.random() * (b - a + 1))
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+    def shuffle(self, x):
+        for i in range(len(x) - 1, 0, -1):
+            j = int(self.random() * (i + 1))
+            x[i], x[j] = x[j], x[i]
+
+
+class TickProfiler:
+    # Замеры тика по фазам: проход по клеткам (scan), перестановки физики (switch) и применение очередей.
+    # Хранит последние window тиков; stats() отдает средние по ним. Поле зовет профайлер только если он
+    # включен (board.profiler не None), так что выключенный профайлер почти ничего не стоит.
+    PHASES = ("scan", "switch") + ACTION_PHASES + ("heat", "blast")
+
+    def __init__(self, window=60):
+        self.history = collections.deque(maxlen=window)
+        self.current = None
+        self.started = 0
+        self.tick_started = 0
+
+    def new_tick(self):
+        self.current = {"total": 0, "time": dict.fromkeys(self.PHASES, 0), "queue": dict.fromkeys(self.PHASES, 0),
+                        "reactions": {}, "replaced": 0}
+        self.tick_started = self.started = time.perf_counter()
+
+    def end_tick(self):
+        self.current["total"] = time.perf_counter() - self.tick_started
+        self.history.append(self.current)
+
+    def begin(self):
+        self.started = time.perf_counter()
+
+    def end(self, phase, queue=0):
+        now = time.perf_counter()
+        self.current["time"][phase] += now - self.started
+        self.current["queue"][phase] += int(queue)
+        self.started = now
+
+    @staticmethod
+    def moved(perm):
+        # сколько клеток физика сдвинула с места
+        return 0 if perm is None else np.count_nonzero(perm.reshape(-1) != np.arange(perm.size))
+
+    def replaced(self, m_type, count=1):
+        # замена клетки (replace) - реакция того материала, который в ней был
+        if self.current is None:
+            return
+        self.current["replaced"] += count
+        self.current["reactions"][m_type] = self.current["reactions"].get(m_type, 0) + count
+
+    def stats(self):
+        ticks = len(self.history)
+        if not ticks:
+            return None
+        reactions = collections.Counter()
+        for tick in self.history:
+            reactions.update(tick["reactions"])
+        return {"ticks": ticks,
+                "ms_per_tick": 1000 * sum(tick["total"] for tick in self.history) / ticks,
+                "phase_ms": {phase: 1000 * sum(tick["time"][phase] for tick in self.history) / ticks
+                             for phase in self.PHASES},
+                "queue": {phase: sum(tick["queue"][phase] for tick in self.history) / ticks for phase in self.PHASES},
+                "reactions": {m_type: count / ticks for m_type, count in reactions.most_common()},
+                "replaced": sum(tick["replaced"] for tick in self.history) / ticks}
+
+    def lines(self):
+        stats = self.stats()
+        if stats is None:
+            return []
+        lines = [f"тик {stats['ms_per_tick']:.1f} мс, замен {stats['replaced']:.0f}"]
+        for phase in self.PHASES:
+            if stats["phase_ms"][phase] >= 0.05 or stats["queue"][phase]:
+                lines.append(f"{phase} {stats['phase_ms'][phase]:.1f} мс, {stats['queue'][phase]:.0f}")
+        for m_type, count in list(stats["reactions"].items())[:5]:
+            lines.append(f"{m_type}: {count:.1f}/тик")
+        return lines
+
+
+class MaterialRegistry:
+    # Реестр прототипов материалов. Общие для типа данные (класс, вес, прочность, растворимость...) живут
+    # в одном прототипе на material_id, новая клетка - это копия прототипа с новым цветом.
+    # Клетки без собственного состояния (воздух, железо, камень...) не создаются вообще: для них заранее
+    # собраны общие экземпляры всех возможных оттенков, и generate_material просто выбирает один из них.
+    state_attributes = ("burning", "temperature", "life_tick", "activated")
+
+    def __init__(self):
+        constructors = {"air": Sandbox.GameObjects.Air, "sand": Sandbox.GameObjects.Sand,
+                        "water": Sandbox.GameObjects.Water, "iron": Sandbox.GameObjects.Iron,
+                        "vapor": Sandbox.GameObjects.Vapor, "fire_4": lambda: Sandbox.GameObjects.Fire(4),
+                        "acid": Sandbox.GameObjects.Acid, "acid_vapor": Sandbox.GameObjects.AVapor,
+                        "dirt": Sandbox.GameObjects.Dirt, "oil": Sandbox.GameObjects.Oil,
+                        "wood": Sandbox.GameObjects.Wood, "coal": Sandbox.GameObjects.Coal,
+                        "fire_5": lambda: Sandbox.GameObjects.Fire(5), "salt": Sandbox.GameObjects.Salt,
+                        "salt_water": Sandbox.GameObjects.SWater, "ice": Sandbox.GameObjects.Ice,
+                        "snow": Sandbox.GameObjects.Snow, "gunpowder": Sandbox.GameObjects.Gunpowder,
+                        "explosion_wave_gp": lambda: Sandbox.GameObjects.ExplosionWave(4, 4),
+                        "explosion_wave_5_5": lambda: Sandbox.GameObjects.ExplosionWave(5, 5),
+                        "sawdust": Sandbox.GameObjects.Sawdust, "methane": Sandbox.GameObjects.Methane,
+                        "wick": Sandbox.GameObjects.Wick, "liquid_nitrogen": Sandbox.GameObjects.LNitrogen,
+                        "nitrogen": Sandbox.GameObjects.Nitrogen, "wax": Sandbox.GameObjects.Wax,
+                        "liquid_wax": Sandbox.GameObjects.LWax, "stone": Sandbox.GameObjects.Stone,
+                        "strong_fire": lambda: Sandbox.GameObjects.StrongFire(5), "lava": Sandbox.GameObjects.Lava,
+                        "tnt": Sandbox.GameObjects.Tnt,
+                        "explosion_wave_tnt": lambda: Sandbox.GameObjects.ExplosionWave(5, 6)}
+        self.prototypes = {}
+        self.colors = {}
+        self.flyweights = {}
+        self.type_ids = {}
+        self.by_color = {}
+        self.rings = {}
+        for material_id, constructor in constructors.items():
+            prototype = constructor()
+            self.type_ids.setdefault(prototype.type, material_id)
+            color, max_color_modifier = MATERIALS[prototype.type][6:8]
+            self.prototypes[material_id] = prototype
+            self.colors[material_id] = (color, max_color_modifier)
+            if not any(hasattr(prototype, name) for name in self.state_attributes):
+                if max_color_modifier:
+                    colors = [tuple(min(255, max(0, c + color_modifier)) for c in color)
+                              for color_modifier in range(-max_color_modifier, max_color_modifier + 2)]
+                else:
+                    colors = [prototype.color]
+                self.flyweights[material_id] = [self.flyweight(prototype, c) for c in colors]
+                for cell in self.flyweights[material_id]:
+                    self.by_color.setdefault((prototype.type, cell.color), cell)
+
+    @staticmethod
+    def flyweight(prototype, color):
+        cell = copy.copy(prototype)
+        cell.color = color
+        cell.shared = True
+        return cell
+
+    def ring(self, wave_range, life):
+        # догорающее кольцо взрыва: общий экземпляр на (радиус, оставшиеся тики), меняется только заменой
+        cell = self.rings.get((wave_range, life))
+        if cell is None:
+            prototype = Sandbox.GameObjects.ExplosionWave(0, wave_range)
+            prototype.life_tick = life
+            cell = self.rings[wave_range, life] = self.flyweight(prototype, prototype.color)
+        return cell
+
+    def create(self, material_id, rnd=random):
+        variants = self.flyweights.get(material_id)
+        if variants is not None:
+            return variants[0] if len(variants) == 1 else rnd.choice(variants)
+        cell = copy.copy(self.prototypes[material_id])
+        color, max_color_modifier = self.colors[material_id]
+        if max_color_modifier:
+            cell.color = approximate_color(*color, max_color_modifier, rnd)
+        return cell
+
+    def restore(self, m_type, color, state):
+        # клетка из сохраненного состояния (поля GRID_FIELDS одной клетки)
+        if not state["freezed"]:
+            cell = self.by_color.get((m_type, tuple(color)))
+            if cell is not None:
+                return cell
+        cell = copy.copy(self.prototypes[self.type_ids[m_type]])
+        cell.shared = False
+        cell.color = tuple(color)
+        for name in self.state_attributes + ("power", "range"):
+            if hasattr(cell, name):
+                setattr(cell, name, type(getattr(cell, name))(state[name]))
+        if state["freezed"]:
+            cell.original_color = tuple(state["original_color"])
+            cell.original_weight = cell.weight
+            cell.original_durability = cell.durability
+            cell.weight = state["weight"]
+            cell.durability = 0
+            cell.freezed = True
+        return cell
+
+
 class Board:
-    def __init__(self, width, height):
+    engine = "objects"
+    workers = 0
+    scan_handlers = {"fire": "scan_fire", "strong_fire": "scan_fire", "acid": "scan_acid", "oil": "scan_burning",
+                     "wood": "scan_burning", "coal": "scan_burning", "sawdust": "scan_burning", "salt": "scan_salt",
+                     "ice": "scan_ice", "explosion_wave": "scan_wave", "wick": "scan_wick",
+                     "liquid_nitrogen": "scan_nitrogen", "liquid_wax": "scan_wax", "lava": "scan_lava"}
+    # действия очередей тика; очередь без действия - это просто правила REACTION_RULES с этим источником
+    phase_actions = {"fire": "fire", "fade": "fade", "freeze": "freeze"}
+
+    def __init__(self, width, height, seed=None):
         self.width = width
         self.height = height
-        self.board = [[Sandbox.GameObjects.Air()] * width for _ in range(height)]
+        # все случайности поля идут из одного генератора: с одинаковым seed поле ведет себя одинаково
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.random = TickRandom(self.rng)
+        # поле делится на чанки chunk_size x chunk_size; чанк засыпает, если в нем sleep_ticks тиков
+        # ничего не менялось, и просыпается, когда в него (или рядом) что-то пишут
+        self.scheduler = True
+        self.chunk_size = 16
+        self.sleep_ticks = 30
+        self.profiler = None
+        # номер тика (паузы не считаются) и журнал ввода, если он пишется
+        self.ticks = 0
+        self.journal = None
+        # обработчики свойств материалов при проходе по клеткам, по коду материала
+        self.handlers = [getattr(self, self.scan_handlers[m_type]) if m_type in self.scan_handlers else None
+                         for m_type in MATERIAL_TYPES]
+        # чанки вне камеры (с запасом в чанк) тикают только каждый offscreen_every-й тик
+        self.offscreen_every = 4
+        self.clear()
         # значения по умолчанию
-        self.left = 10
-        self.top = 10
-        self.cell_size = 30
         self.current_material = "air"
         self.brush = 1
         self.pause = False
         self.physics = True
         self.features = True
-
-    def set_view(self, left, top, cell_size):
+        # "full" - каждый кадр рисуется все поле, "dirty" - только клетки, сменившие цвет,
+        # "pixels" - поле пишется в маленькую картинку (клетка = пиксель) и растягивается на экран
+        self.render_mode = "full"
+        self.drawn = None
+        self.pixels = None
+        self.scaled = None
+        self.camera = (0, 0)
+        self.viewed = None
+        self.set_view(10, 10, 30)
+
+    def set_view(self, left, top, cell_size, view_width=None, view_height=None):
+        # Поле показывается в области экрана view_width x view_height пикселей (по умолчанию - все поле).
+        # Если поле больше, видна только его часть: камера - верхняя левая видимая клетка (x, y)
         self.left = left
         self.top = top
         self.cell_size = cell_size
+        self.view_width = self.width * cell_size if view_width is None else view_width
+        self.view_height = self.height * cell_size if view_height is None else view_height
+        self.move_camera(*self.camera)
+
+    def move_camera(self, x, y):
+        cols, rows = self.view_width // self.cell_size, self.view_height // self.cell_size
+        self.camera = (max(0, min(x, self.width - cols)), max(0, min(y, self.height - rows)))
+        self.drawn = None
+        self.focus = self.visible()
+        if (self.camera, self.cell_size) != self.viewed:
+            self.viewed = (self.camera, self.cell_size)
+            self.record("camera", self.camera, self.cell_size)
+
+    def pan(self, dx, dy):
+        self.move_camera(self.camera[0] + dx, self.camera[1] + dy)
+
+    def zoom(self, steps, anchor=None):
+        # клетка вдвое больше или меньше за шаг; клетка под anchor (мышью) остается на месте
+        cell_size = max(1, min(64, int(self.cell_size * 2 ** steps)))
+        if cell_size == self.cell_size:
+            return
+        if anchor is None:
+            anchor = (self.left + self.view_width // 2, self.top + self.view_height // 2)
+        x = self.camera[0] + (anchor[0] - self.left) / self.cell_size
+        y = self.camera[1] + (anchor[1] - self.top) / self.cell_size
+        self.cell_size = cell_size
+        self.move_camera(round(x - (anchor[0] - self.left) / cell_size), round(y - (anchor[1] - self.top) / cell_size))
+
+    def visible(self):
+        # видимые клетки (y0, y1, x0, x1)
+        x0, y0 = self.camera
+        return (y0, min(self.height, y0 + self.view_height // self.cell_size),
+                x0, min(self.width, x0 + self.view_width // self.cell_size))
 
     def set_material(self, material):
         self.current_material = material
@@ -65,26 +930,92 @@ class Board:
     def set_brush(self, brush):
         self.brush = brush if brush % 2 == 1 else brush - 1
 
+    def set_profiler(self, enabled):
+        self.profiler = TickProfiler() if enabled else None
+
+    def set_render_mode(self, mode):
+        self.render_mode = mode
+        self.drawn = None
+
+    def get_rect(self):
+        y0, y1, x0, x1 = self.visible()
+        return pygame.Rect(self.left, self.top, (x1 - x0) * self.cell_size, (y1 - y0) * self.cell_size)
+
     def render(self, surf):
-        for i in range(self.width):
-            for j in range(self.height):
+        # возвращает список прямоугольников экрана, которые изменились
+        if self.render_mode == "dirty":
+            return self.render_dirty(surf)
+        if self.render_mode == "pixels":
+            return self.render_pixels(surf)
+        y0, y1, x0, x1 = self.visible()
+        for i in range(x0, x1):
+            for j in range(y0, y1):
                 pygame.draw.rect(surf, color=self.board[j][i].color, rect=(
-                    self.left + i * self.cell_size,
-                    self.top + j * self.cell_size,
+                    self.left + (i - x0) * self.cell_size,
+                    self.top + (j - y0) * self.cell_size,
                     self.cell_size,
                     self.cell_size))
+        return [self.get_rect()]
+
+    def render_dirty(self, surf):
+        # цвета клеток никогда не меняются на месте, а присваиваются заново,
+        # поэтому для большинства клеток хватает проверки "тот же ли это объект цвета"
+        y0, y1, x0, x1 = self.visible()
+        if self.drawn is None:
+            self.drawn = [[None] * (x1 - x0) for _ in range(y1 - y0)]
+        rects = []
+        for j, row in enumerate(self.board[y0:y1]):
+            drawn = self.drawn[j]
+            for i, element in enumerate(row[x0:x1]):
+                color = element.color
+                if color is not drawn[i]:
+                    if color != drawn[i]:
+                        rects.append(pygame.draw.rect(surf, color=color, rect=(
+                            self.left + i * self.cell_size,
+                            self.top + j * self.cell_size,
+                            self.cell_size,
+                            self.cell_size)))
+                    drawn[i] = color
+        return self.changed_rects(rects)
+
+    def render_pixels(self, surf):
+        rect = self.get_rect()
+        region = self.visible()
+        size = (region[3] - region[2], region[1] - region[0])
+        if self.pixels is None or self.pixels.get_size() != size:
+            self.pixels = pygame.Surface(size)
+        pygame.surfarray.blit_array(self.pixels, self.color_buffer(region).transpose(1, 0, 2))
+        if self.cell_size == 1:
+            surf.blit(self.pixels, rect)
+            return [rect]
+        if self.scaled is None or self.scaled.get_size() != rect.size:
+            self.scaled = pygame.Surface(rect.size)
+        pygame.transform.scale(self.pixels, rect.size, self.scaled)
+        surf.blit(self.scaled, rect)
+        return [rect]
+
+    def color_buffer(self, region=None):
+        y0, y1, x0, x1 = region or (0, self.height, 0, self.width)
+        return np.array([[element.color for element in row[x0:x1]] for row in self.board[y0:y1]], dtype=np.uint8)
+
+    def changed_rects(self, rects):
+        # если поменялась заметная часть поля, одним прямоугольником обновлять экран дешевле
+        y0, y1, x0, x1 = self.visible()
+        if len(rects) > (y1 - y0) * (x1 - x0) // 4:
+            return [self.get_rect()]
+        return rects
 
     def get_cell(self, mouse_pos):
-        if not self.left <= mouse_pos[0] <= self.left + self.width * self.cell_size - 1 or \
-                not self.top <= mouse_pos[1] <= self.top + self.height * self.cell_size - 1:
+        if not self.get_rect().collidepoint(mouse_pos):
             return None
         x, y = mouse_pos[0] - self.left, mouse_pos[1] - self.top
-        return x // self.cell_size, y // self.cell_size
+        return self.camera[0] + x // self.cell_size, self.camera[1] + y // self.cell_size
 
     def on_click(self, cell_pos):
         if cell_pos is None:
             return
         x, y = cell_pos
+        self.wake(y - self.brush // 2, y + self.brush // 2 + 1, x - self.brush // 2, x + self.brush // 2 + 1)
         if self.brush == 1:
             self.board[y][x] = self.generate_material(self.current_material)
         else:
@@ -95,348 +1026,1423 @@ class Board:
                             self.board[y + i][x + j] = self.generate_material(self.current_material)
                     except Exception:
                         pass
+        self.count_region(y - self.brush // 2, y + self.brush // 2 + 1, x - self.brush // 2, x + self.brush // 2 + 1)
 
     def get_click(self, mouse_pos):
         cell = self.get_cell(mouse_pos)
+        if cell is not None:
+            self.record("paint", cell)
         self.on_click(cell)
 
+    def start_journal(self):
+        self.journal = []
+        self.record("camera", self.camera, self.cell_size)
+
+    def record(self, action, cell=(-1, -1), brush=None):
+        if self.journal is not None:
+            self.journal.append((self.ticks, action, cell, self.current_material,
+                                 self.brush if brush is None else brush))
+
+    def save_journal(self, path):
+        write_journal(path, {"seed": self.seed, "engine": self.engine, "width": self.width, "height": self.height,
+                             "workers": self.workers, "ticks": self.ticks, "view_width": self.view_width,
+                             "view_height": self.view_height}, self.journal)
+
+    def apply_input(self, action, cell, material, brush):
+        # одна запись журнала ввода - то же, что сделала бы кнопка мыши или меню
+        if action == "paint":
+            # клик мог прийти из окна, которое еще не знает, что поле после загрузки снимка стало меньше
+            if not (0 <= cell[0] < self.width and 0 <= cell[1] < self.height):
+                return
+            self.set_material(material)
+            self.set_brush(brush)
+            self.on_click(cell)
+        elif action == "clear":
+            self.clear()
+        elif action == "pause":
+            self.set_pause()
+        elif action == "physics":
+            self.toggle_obj_physics()
+        elif action == "features":
+            self.toggle_obj_features()
+        elif action == "camera":
+            # у камеры в поле "кисть" записан размер клетки: от него зависит, какие чанки видны
+            self.cell_size = brush
+            self.move_camera(*cell)
+
+    def fill(self, x, y, width, height, material_id):
+        # заливка прямоугольника клеток одним материалом (для сцен)
+        y0, y1, x0, x1 = max(0, y), min(self.height, y + height), max(0, x), min(self.width, x + width)
+        self.wake(y0, y1, x0, x1)
+        for j in range(y0, y1):
+            for i in range(x0, x1):
+                self.board[j][i] = self.generate_material(material_id)
+        self.count_region(y0, y1, x0, x1)
+
+    def save(self, path):
+        write_snapshot(path, self.height, self.width, self.cell_arrays())
+
+    def load(self, path):
+        # поле заменяется снимком целиком, вместе с размером
+        height, width, fields = read_snapshot(path)
+        self.height, self.width = height, width
+        self.set_cell_arrays(fields)
+        self.count_all()
+        self.wake_all()
+        self.move_camera(*self.camera)
+
+    def cell_arrays(self):
+        # клетки-объекты в виде массивов GRID_FIELDS, как их хранит GridBoard; тепло лежит отдельным массивом
+        cells = [element for row in self.board for element in row]
+        fields = {}
+        for name, dtype, dims in GRID_FIELDS:
+            if name == "heat":
+                values = self.heat
+            elif name == "mat":
+                values = [element.code for element in cells]
+            elif name == "original_color":
+                values = [element.original_color if element.freezed else (0, 0, 0) for element in cells]
+            else:
+                values = [getattr(element, name, 0) for element in cells]
+            fields[name] = np.array(values, dtype=dtype).reshape((self.height, self.width) + dims)
+        return fields
+
+    def set_cell_arrays(self, fields):
+        columns = {name: fields[name].reshape((-1,) + dims).tolist() for name, dtype, dims in GRID_FIELDS}
+        names = [name for name, dtype, dims in GRID_FIELDS]
+        cells = [MATERIAL_REGISTRY.restore(MATERIAL_TYPES[values[0]], values[names.index("color")],
+                                           dict(zip(names, values)))
+                 for values in zip(*(columns[name] for name in names))]
+        self.board = [cells[j * self.width:(j + 1) * self.width] for j in range(self.height)]
+        self.neighbors = neighbor_table(self.height, self.width)
+        self.heat = np.array(fields["heat"], dtype=np.int16)
+
     def switch(self, cell1, cell2):
         cl1 = self.board[cell1[0]][cell1[1]]
-        self.board[cell1[0]][cell1[1]] = self.board[cell2[0]][cell2[1]]
-        self.board[cell2[0]][cell2[1]] = cl1
+        self.put(cell1, self.board[cell2[0]][cell2[1]])
+        self.put(cell2, cl1)
 
     def replace(self, cell, material_id):
-        self.board[cell[0]][cell[1]] = self.generate_material(material_id)
+        if self.profiler is not None:
+            self.profiler.replaced(self.board[cell[0]][cell[1]].type)
+        self.put(cell, self.generate_material(material_id))
 
     def eq_replace(self, coords1, coords2):
-        self.board[coords2[0]][coords2[1]] = self.board[coords1[0]][coords1[1]]
+        self.put(coords2, self.board[coords1[0]][coords1[1]])
+
+    def put(self, cell, element):
+        # запись клетки вместе со счетчиками материалов ее чанка
+        old = self.board[cell[0]][cell[1]]
+        self.board[cell[0]][cell[1]] = element
+        if old.code != element.code:
+            counts = self.population[cell[0] // self.chunk_size, cell[1] // self.chunk_size]
+            counts[old.code] -= 1
+            counts[element.code] += 1
 
     def clear(self):
-        self.board = [[Sandbox.GameObjects.Air()] * self.width for _ in range(self.height)]
+        self.board = [[self.generate_material("air")] * self.width for _ in range(self.height)]
+        self.neighbors = neighbor_table(self.height, self.width)
+        # тепло клеток хранится массивом, а не в клетках: клетки-объекты бывают общими (flyweight)
+        self.heat = np.zeros((self.height, self.width), dtype=np.int16)
+        self.count_all()
+        self.wake_all()
+
+    # Счетчики материалов: population[cy, cx, code] - сколько клеток материала в чанке. Клетки, которые
+    # пишутся по одной (replace, switch, eq_replace), обновляют их сразу, кисть и заливка - пересчетом
+    # своих чанков, физика - по клеткам, перешедшим в другой чанк.
+
+    def count_all(self):
+        cs = self.chunk_size
+        self.population = np.zeros((-(-self.height // cs), -(-self.width // cs), len(MATERIAL_TYPES)),
+                                   dtype=np.int32)
+        self.count_region(0, self.height, 0, self.width)
+
+    def count_region(self, y0, y1, x0, x1):
+        # пересчет чанков, задевающих прямоугольник клеток [y0, y1) x [x0, x1)
+        cs = self.chunk_size
+        y0, x0 = max(0, y0) // cs * cs, max(0, x0) // cs * cs
+        y1, x1 = min(self.height, -(-y1 // cs) * cs), min(self.width, -(-x1 // cs) * cs)
+        if y1 <= y0 or x1 <= x0:
+            return
+        rows, cols = -(-(y1 - y0) // cs), -(-(x1 - x0) // cs)
+        chunk = (np.arange(y1 - y0) // cs)[:, None] * cols + (np.arange(x1 - x0) // cs)[None, :]
+        counts = np.bincount((chunk * len(MATERIAL_TYPES) + self.codes((y0, y1, x0, x1))).reshape(-1),
+                             minlength=rows * cols * len(MATERIAL_TYPES))
+        self.population[y0 // cs:y0 // cs + rows, x0 // cs:x0 // cs + cols] = \
+            counts.reshape(rows, cols, len(MATERIAL_TYPES))
+
+    def count_moves(self, outer, perm, cells):
+        # физика переставляет клетки внутри outer; счетчики меняются только у перешедших в другой чанк
+        y0, y1, x0, x1 = outer
+        cs = self.chunk_size
+        chunk = ((np.arange(y0, y1) // cs)[:, None] * self.population.shape[1] +
+                 (np.arange(x0, x1) // cs)[None, :]).reshape(-1)
+        source = perm.reshape(-1)
+        moved = np.flatnonzero(chunk[source] != chunk)
+        if not moved.size:
+            return
+        codes = np.array([cells[k].code for k in source[moved].tolist()], dtype=np.intp)
+        counts = self.population.reshape(-1, len(MATERIAL_TYPES))
+        np.add.at(counts, (chunk[moved], codes), 1)
+        np.subtract.at(counts, (chunk[source[moved]], codes), 1)
+
+    def codes(self, region):
+        y0, y1, x0, x1 = region
+        return np.array([[element.code for element in row[x0:x1]] for row in self.board[y0:y1]], dtype=np.intp)
+
+    def count(self, m_type, region=None):
+        # число клеток материала на поле (или в чанках, задевающих region)
+        region = region or (0, self.height, 0, self.width)
+        return int(self.population[self.window_chunks(region) + (MATERIAL_CODES[m_type],)].sum())
+
+    def cells_of(self, m_type, region=None):
+        # координаты (y, x) клеток материала, по чанкам; чанки, где материала нет, не просматриваются
+        y0, y1, x0, x1 = region or (0, self.height, 0, self.width)
+        code = MATERIAL_CODES[m_type]
+        cs = self.chunk_size
+        rows, cols = self.window_chunks((y0, y1, x0, x1))
+        cells = []
+        for cy, cx in zip(*np.nonzero(self.population[rows, cols, code])):
+            box = (max(y0, (cy + rows.start) * cs), min(y1, (cy + rows.start + 1) * cs),
+                   max(x0, (cx + cols.start) * cs), min(x1, (cx + cols.start + 1) * cs))
+            ys, xs = np.nonzero(self.codes(box) == code)
+            cells.extend(zip((ys + box[0]).tolist(), (xs + box[2]).tolist()))
+        return cells
+
+    def present(self, region):
+        # типы материалов, которые есть в чанках, задевающих region
+        counts = self.population[self.window_chunks(region)]
+        return {MATERIAL_TYPES[code] for code in np.flatnonzero(counts.any((0, 1)))}
+
+    def composition(self, top=5):
+        # самые многочисленные материалы поля, кроме воздуха
+        totals = self.population.sum((0, 1))
+        order = np.argsort(-totals, kind="stable")
+        return [(MATERIAL_TYPES[code], int(totals[code])) for code in order
+                if totals[code] and MATERIAL_TYPES[code] != "air"][:top]
 
     def set_pause(self):
         self.pause = not self.pause
 
     def toggle_obj_physics(self):
         self.physics = not self.physics
+        self.wake_all()
 
     def toggle_obj_features(self):
         self.features = not self.features
+        self.wake_all()
+
+    def wake_all(self):
+        chunks = (-(-self.height // self.chunk_size), -(-self.width // self.chunk_size))
+        self.awake = np.ones(chunks, dtype=bool)
+        self.idle = np.zeros(chunks, dtype=np.int32)
+
+    def wake(self, y0, y1, x0, x1):
+        # будит чанки, задевающие прямоугольник клеток [y0, y1) x [x0, x1) с отступом в одну клетку
+        cs = self.chunk_size
+        y0, x0 = max(0, y0 - 1) // cs, max(0, x0 - 1) // cs
+        y1, x1 = min(self.height, y1 + 1), min(self.width, x1 + 1)
+        if y1 <= 0 or x1 <= 0:
+            return
+        self.awake[y0:(y1 - 1) // cs + 1, x0:(x1 - 1) // cs + 1] = True
+        self.idle[y0:(y1 - 1) // cs + 1, x0:(x1 - 1) // cs + 1] = 0
+
+    def due_chunks(self):
+        # бодрствующие чанки, которым пора тикать: те, что вне камеры, тикают реже
+        if self.ticks % self.offscreen_every == 0:
+            return self.awake
+        cs = self.chunk_size
+        y0, y1, x0, x1 = self.focus
+        rows, cols = self.window_chunks((max(0, y0 - cs), min(self.height, y1 + cs),
+                                         max(0, x0 - cs), min(self.width, x1 + cs)))
+        due = np.zeros_like(self.awake)
+        due[rows, cols] = self.awake[rows, cols]
+        return due
+
+    def active_windows(self, awake):
+        # прямоугольники клеток вокруг связных групп чанков awake (y0, y1, x0, x1)
+        boxes = []
+        seen = np.zeros_like(awake)
+        for cy, cx in zip(*np.nonzero(awake & ~seen)):
+            if seen[cy, cx]:
+                continue
+            seen[cy, cx] = True
+            stack = [(cy, cx)]
+            box = [cy, cy, cx, cx]
+            while stack:
+                y, x = stack.pop()
+                box = [min(box[0], y), max(box[1], y), min(box[2], x), max(box[3], x)]
+                for ny in range(max(0, y - 1), min(awake.shape[0], y + 2)):
+                    for nx in range(max(0, x - 1), min(awake.shape[1], x + 2)):
+                        if awake[ny, nx] and not seen[ny, nx]:
+                            seen[ny, nx] = True
+                            stack.append((ny, nx))
+            boxes.append(box)
+        # пересекающиеся прямоугольники объединяются, чтобы ни одна клетка не обновлялась дважды за тик
+        merged = True
+        while merged:
+            merged = False
+            for a in range(len(boxes)):
+                for b in range(a + 1, len(boxes)):
+                    if boxes[a][0] <= boxes[b][1] and boxes[b][0] <= boxes[a][1] and \
+                            boxes[a][2] <= boxes[b][3] and boxes[b][2] <= boxes[a][3]:
+                        boxes[a] = [min(boxes[a][0], boxes[b][0]), max(boxes[a][1], boxes[b][1]),
+                                    min(boxes[a][2], boxes[b][2]), max(boxes[a][3], boxes[b][3])]
+                        del boxes[b]
+                        merged = True
+                        break
+                if merged:
+                    break
+        cs = self.chunk_size
+        return [(y0 * cs, min(self.height, (y1 + 1) * cs), x0 * cs, min(self.width, (x1 + 1) * cs))
+                for y0, y1, x0, x1 in boxes]
+
+    def tick_board(self):
+        if self.pause:
+            return
+        self.random.new_tick()
+        if self.profiler is not None:
+            self.profiler.new_tick()
+        if not self.scheduler:
+            self.tick_region((0, self.height, 0, self.width), (0, self.height, 0, self.width))
+            self.resolve_blasts()
+        else:
+            touched = np.zeros_like(self.awake)
+            simulated = np.zeros_like(self.awake)
+            for window in self.active_windows(self.due_chunks()):
+                touched[self.tick_tracked(window)] = True
+                simulated[self.window_chunks(window)] = True
+            self.resolve_blasts()
+            self.update_chunks(touched, simulated)
+        self.ticks += 1
+        if self.profiler is not None:
+            self.profiler.end_tick()
+
+    def tick_tracked(self, window):
+        # тик окна, возвращает индексы чанков, в которых (или рядом с которыми) что-то изменилось.
+        # Окно обновляется вместе с рамкой в две клетки: в первую клетку рамки можно писать
+        # (падение, огонь у соседей), вторая нужна, чтобы правильно видеть соседей первой
+        cs = self.chunk_size
+        outer = (max(0, window[0] - 2), min(self.height, window[1] + 2),
+                 max(0, window[2] - 2), min(self.width, window[3] + 2))
+        before = self.snapshot(outer)
+        heat = self.heat[outer[0]:outer[1], outer[2]:outer[3]].copy()
+        self.tick_region(window, outer)
+        # тепло - тоже изменение: иначе оно останавливалось бы на краю окна и не доходило до спящих чанков
+        changed = self.changed_cells(outer, before) | (self.heat[outer[0]:outer[1], outer[2]:outer[3]] != heat)
+        ys, xs = np.nonzero(dilate(changed))
+        return (ys + outer[0]) // cs, (xs + outer[2]) // cs
+
+    def window_chunks(self, window):
+        cs = self.chunk_size
+        return slice(window[0] // cs, (window[1] - 1) // cs + 1), slice(window[2] // cs, (window[3] - 1) // cs + 1)
+
+    def update_chunks(self, touched, simulated):
+        cs = self.chunk_size
+        self.idle[simulated] += 1
+        self.idle[touched] = 0
+        self.awake |= touched
+        for cy, cx in zip(*np.nonzero(self.awake & (self.idle >= self.sleep_ticks))):
+            if self.restless((cy * cs, min(self.height, (cy + 1) * cs), cx * cs, min(self.width, (cx + 1) * cs))):
+                self.idle[cy, cx] = 0
+            else:
+                self.awake[cy, cx] = False
+
+    def snapshot(self, outer):
+        y0, y1, x0, x1 = outer
+        return [[(element, element.color) for element in row[x0:x1]] for row in self.board[y0:y1]]
+
+    def changed_cells(self, outer, before):
+        y0, y1, x0, x1 = outer
+        return np.array([[element is not old or element.color is not color
+                          for element, (old, color) in zip(row[x0:x1], old_row)]
+                         for row, old_row in zip(self.board[y0:y1], before)], dtype=bool)
+
+    def restless(self, region):
+        y0, y1, x0, x1 = region
+        if self.heat[y0:y1, x0:x1].any():
+            return True
+        for row in self.board[y0:y1]:
+            for element in row[x0:x1]:
+                if element.type in RESTLESS_TYPES or element.freezed or getattr(element, "burning", False) or \
+                        getattr(element, "activated", False):
+                    return True
+        return False
+
+    def own(self, coords):
+        # общую (flyweight) клетку перед изменением нужно заменить ее собственной копией
+        element = self.board[coords[0]][coords[1]]
+        if element.shared:
+            element = copy.copy(element)
+            element.shared = False
+            self.board[coords[0]][coords[1]] = element
+        return element
 
     def get_neighbors_coords(self, cell):
-        result = []
-        for coords in [(0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)]:
-            if (0 <= cell[0] + coords[0] < self.height) and (0 <= cell[1] + coords[1] < self.width):
-                result.append((cell[0] + coords[0], cell[1] + coords[1]))
-        return result
+        # готовый кортеж из таблицы соседей, менять его нельзя
+        return self.neighbors[cell[0]][cell[1]]
 
     def get_air_neighbors_coords(self, cell):
-        return list(filter(lambda x: self.board[x[0]][x[1]].type == "air", self.get_neighbors_coords(cell)))
+        return [x for x in self.neighbors[cell[0]][cell[1]] if self.board[x[0]][x[1]].type == "air"]
+
+    def near_water(self, outer):
+        # клетки окна outer, рядом с которыми (по состоянию на первое обращение за тик) есть вода
+        y0, y1, x0, x1 = outer
+        return dilate(np.array([[element.type == "water" for element in row[x0:x1]]
+                                for row in self.board[y0:y1]], dtype=bool)).tolist()
+
+    def react(self, source, coords):
+        # правило из REACTIONS[source] для клетки coords; True, если оно сработало
+        element = self.board[coords[0]][coords[1]]
+        rule = REACTIONS[source][element.code]
+        if rule is None or rule[0] and self.random.randint(0, rule[0]) != 0:
+            return False
+        self.replace(coords, rule[2])
+        return True
 
     def fire(self, coords):
         element = self.board[coords[0]][coords[1]]
         if element.freezed:
             self.board[coords[0]][coords[1]].unfreeze()
             return
-        if element.type == "water":
-            self.replace(coords, "vapor")
-        elif element.type == "acid":
-            self.replace(coords, "acid_vapor")
-        elif element.cls in ["ignitable_solid", "ignitable_liquid", "ignitable_falling"]:
-            neighbors = [self.board[x[0]][x[1]].type for x in self.get_neighbors_coords(coords)]
-            if 'air' in neighbors and "water" not in neighbors and "vapor" not in neighbors and \
-                    "salt_water" not in neighbors and "liquid_nitrogen" not in neighbors:
+        if self.react("fire", coords):
+            return
+        if element.ignitable:
+            neighbors = {self.board[x[0]][x[1]].type for x in self.neighbors[coords[0]][coords[1]]}
+            if 'air' in neighbors and neighbors.isdisjoint(WET_TYPES):
                 self.board[coords[0]][coords[1]].burn()
         elif element.type == "salt_water":
             air_neighbors = self.get_air_neighbors_coords(coords)
-            if air_neighbors and random.randint(0, 3) == 0:
-                self.replace(random.choice(air_neighbors), "vapor")
+            if air_neighbors and self.random.randint(0, 3) == 0:
+                self.replace(self.random.choice(air_neighbors), "vapor")
                 self.replace(coords, "salt")
             else:
                 self.replace(coords, "vapor")
-        elif element.type in ["ice", "snow"]:
-            self.replace(coords, "water")
-        elif element.type in ["gunpowder", 'tnt']:
-            self.explode(coords)
-        elif element.type == "methane":
-            self.replace(coords, "fire_5")
         elif element.type == "wick":
-            self.board[coords[0]][coords[1]].activate()
-        elif element.type == "wax":
-            self.replace(coords, "liquid_wax")
-
-    def strong_fire(self, coords):
-        element = self.board[coords[0]][coords[1]]
-        if element.type == 'stone' and random.randint(0, 45) == 0:
-            self.replace(coords, 'lava')
-        else:
-            self.fire(coords)
+            self.board[coords[0]][coords[1]].activate(self.random)
 
     def fade(self, coords):
-        if self.board[coords[0]][coords[1]].cls in ["ignitable_solid", "ignitable_falling"] and \
-                self.board[coords[0]][coords[1]].burning:
-            neighbors = [self.board[x[0]][x[1]].type for x in self.get_neighbors_coords(coords)]
-            if ("air" not in neighbors and "fire" not in neighbors) or "salt_water" in neighbors or \
-                    "water" in neighbors or "vapor" in neighbors or "liquid_nitrogen" in neighbors:
-                self.board[coords[0]][coords[1]].fade()
-
-    def set_fire_on_burning(self, coords, chance):
-        if self.board[coords[0]][coords[1]].type == "air" and random.randint(0, chance) == 0:
-            self.replace(coords, "fire_4")
-
-    def acid(self, coords):
-        if self.board[coords[0]][coords[1]].soluble:
-            self.replace(coords, "air")
-            return True
-        return False
-
-    def salt(self, coords):
-        if self.board[coords[0]][coords[1]].type == "water":
-            self.replace(coords, "salt_water")
-
-    def ice(self, coords):
-        if self.board[coords[0]][coords[1]].type == "water":
-            if random.randint(0, 50) == 0:
-                self.replace(coords, "ice")
-        elif self.board[coords[0]][coords[1]].type == "vapor":
-            if random.randint(0, 15) == 0:
-                self.replace(coords, "snow")
+        element = self.board[coords[0]][coords[1]]
+        if element.smoulders and element.burning:
+            neighbors = {self.board[x[0]][x[1]].type for x in self.neighbors[coords[0]][coords[1]]}
+            if ("air" not in neighbors and "fire" not in neighbors) or not neighbors.isdisjoint(WET_TYPES):
+                element.fade()
 
     def freeze(self, coords):
         element = self.board[coords[0]][coords[1]]
         if element.freezed:
             return
-        if element.cls in ["ignitable_solid", "ignitable_falling", "ignitable_liquid"]:
+        if element.ignitable:
             if element.burning:
-                element.fade()
-        elif element.type in ["water", "salt_water"]:
-            self.replace(coords, "ice")
-        elif element.type in ["fire"]:
-            self.replace(coords, "air")
-        elif element.type == "liquid_wax":
-            self.replace(coords, "wax")
-        elif element.type == "lava":
-            self.replace(coords, "stone")
+                element.fade(self.random)
+        else:
+            self.react("freeze", coords)
         if element.can_be_freezed:
-            self.board[coords[0]][coords[1]].freeze()
-
-    def explode(self, coords):
-        if self.board[coords[0]][coords[1]].type == "gunpowder":
-            self.replace(coords, "explosion_wave_gp")
-        elif self.board[coords[0]][coords[1]].type == "tnt":
-            self.replace(coords, "explosion_wave_tnt")
-
-
-    def explosion_wave(self, coords):
-        wave = self.board[coords[0]][coords[1]]
-        if wave.life_tick >= 1:
-            for co in self.get_neighbors_coords(coords):
-                element2 = self.board[co[0]][co[1]]
-                if element2.durability <= wave.power:
-                    self.board[co[0]][co[1]] = Sandbox.GameObjects.ExplosionWave(wave.power - 1, wave.range - 1)
+            self.own(coords).freeze()
 
-    def tick_board(self):
-        if self.pause:
+    def resolve_blasts(self):
+        # Новые взрывы (explosion_wave с силой > 0) считаются в конце тика все разом, одним проходом
+        # blast_rings по общему для них прямоугольнику: все, до чего дотянется волна, сразу становится
+        # догорающим кольцом (сила 0), которое несколько тиков поджигает соседей и исчезает
+        if not self.count("explosion_wave"):
+            return
+        sources = self.blast_sources()
+        if not sources:
             return
-        random_i = list(range(self.width))
-        random.shuffle(random_i)
-        to_lava = []
-        to_switch = []
-        to_fire = []
-        to_strong_fire = []
-        to_fire_on_burning = []
-        to_fade = []
-        to_salt = []
-        to_ice = []
-        to_expwave = []
-        to_freeze = []
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin()
+        ys, xs, power, wave_range = np.array(sources).T
+        region = (max(0, ys.min() - BLAST_REACH), min(self.height, ys.max() + BLAST_REACH + 1),
+                  max(0, xs.min() - BLAST_REACH), min(self.width, xs.max() + BLAST_REACH + 1))
+        shape = (region[1] - region[0], region[3] - region[2])
+        powers, ranges = np.zeros(shape, dtype=np.int16), np.zeros(shape, dtype=np.int16)
+        powers[ys - region[0], xs - region[2]] = power
+        ranges[ys - region[0], xs - region[2]] = wave_range
+        reached, ranges = blast_rings(self.durabilities(region), powers, ranges)
+        self.set_rings(region, reached, ranges)
+        self.wake(*region)
+        if profiler is not None:
+            profiler.end("blast", len(sources))
+
+    def blast_sources(self):
+        sources = []
+        for y, x in self.cells_of("explosion_wave"):
+            element = self.board[y][x]
+            if element.power > 0:
+                sources.append((y, x, element.power, element.range))
+        return sources
+
+    def durabilities(self, region):
+        y0, y1, x0, x1 = region
+        return np.array([[element.durability for element in row[x0:x1]] for row in self.board[y0:y1]],
+                        dtype=np.int16)
+
+    def set_rings(self, region, reached, ranges):
+        for j, i in zip(*np.nonzero(reached)):
+            self.put((region[0] + j, region[2] + i), MATERIAL_REGISTRY.ring(int(ranges[j, i]), 2))
+
+    # Свойства материалов при проходе по клеткам. Все, что сводится к "материал + сосед -> новые материалы",
+    # описано в REACTION_RULES, а здесь остается только поведение, которое правилом не выразить.
+    # Материал без обработчика и без правила про саму клетку пропускается одним обращением к списку.
+
+    def scan_fire(self, j, i, element):
+        if element.temperature <= 1:
+            self.replace((j, i), "air")
+        else:
+            element.fade()
+        self.queues["fire"].update(self.neighbors[j][i])
+
+    def scan_acid(self, j, i, element):
+        rules = REACTIONS["acid"]
+        for coords in self.neighbors[j][i]:
+            rule = rules[self.board[coords[0]][coords[1]].code]
+            if rule is not None and self.random.randint(0, rule[0]) == 0:
+                self.replace(coords, rule[2])
+                self.replace((j, i), rule[1])
+
+    def scan_burning(self, j, i, element):
+        if not element.burning:
+            return
+        if element.smoulders:
+            self.queues["fade"].add((j, i))
+            element.random_burning_color(self.random)
+        neighbors = self.neighbors[j][i]
+        self.queues["fire"].update(neighbors)
+        self.queues["fire_on_burning"].update(neighbors)
+        if self.random.randint(0, element.extinct_chance) == 0:
+            self.replace((j, i), "air")
+
+    def scan_salt(self, j, i, element):
+        if self.water_adjacent(j, i):
+            self.queues["salt"].update(self.neighbors[j][i])
+            if self.random.randint(0, 2) == 0:
+                self.replace((j, i), "air")
+
+    def scan_ice(self, j, i, element):
+        if self.water_adjacent(j, i):
+            self.queues["ice"].update(self.neighbors[j][i])
+
+    def scan_wave(self, j, i, element):
+        # новый взрыв ждет resolve_blasts, кольцо догорает и поджигает соседей
+        if element.power > 0:
+            return
+        if element.life_tick <= 0:
+            self.replace((j, i), "air")
+        else:
+            self.put((j, i), MATERIAL_REGISTRY.ring(element.range, element.life_tick - 1))
+            self.queues["fire"].update(self.neighbors[j][i])
+
+    def scan_wick(self, j, i, element):
+        if element.activated:
+            self.queues["fire"].update(self.neighbors[j][i])
+            self.replace((j, i), "air")
+
+    def scan_nitrogen(self, j, i, element):
+        self.queues["freeze"].update(self.neighbors[j][i])
+
+    def scan_wax(self, j, i, element):
+        if self.random.randint(0, 50) == 0 and (j + 1 == self.height or
+                                                self.board[j + 1][i].weight >= element.weight):
+            self.replace((j, i), "wax")
+
+    def scan_lava(self, j, i, element):
+        neighbors = self.neighbors[j][i]
+        if any(self.board[x[0]][x[1]].type != 'lava' for x in neighbors):
+            self.queues["fire"].update(neighbors)
+            self.queues["lava"].update(neighbors)
+
+    def water_adjacent(self, j, i):
+        # маска строится при первом обращении: спрашивают о воде только соль, лед и замороженные клетки
+        if self.water_outer is None:
+            return False
+        if self.water_near is None:
+            self.water_near = self.near_water(self.water_outer)
+        return self.water_near[j - self.water_outer[0]][i - self.water_outer[2]]
+
+    def tick_region(self, window, outer):
+        # один тик для клеток окна window; outer - окно вместе с рамкой, в которую клетки могут сдвинуться
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin()
+        random_i = list(range(window[2], window[3]))
+        self.random.shuffle(random_i)
+        # очереди отложенных действий - множества клеток: клетка, которую подожгли с нескольких сторон,
+        # обрабатывается в каждой фазе один раз (как в GridBoard), и очередь не больше самого окна
+        queues = self.queues = {phase: set() for phase in ACTION_PHASES}
+        # соседи берутся из готовой таблицы, а "есть ли рядом вода" - одним обращением к маске
+        # (маска строится только при первом вопросе о воде и только если вода есть в чанках окна по счетчикам)
+        table = self.neighbors
+        present = self.present(outer)
+        self.water_near = None
+        self.water_outer = outer if "water" in present else None
+        handlers = self.handlers
+        self_rules = REACTIONS["self"]
         for i in random_i:
-            for j in range(self.height):
+            for j in range(window[0], window[1]):
                 element = self.board[j][i]
                 if element.freezed:
-                    neighbors = self.get_neighbors_coords((j, i))
-                    if "water" in [self.board[x[0]][x[1]].type for x in neighbors]:
-                        for coords in neighbors:
-                            to_ice.append(coords)
+                    if self.water_adjacent(j, i):
+                        queues["ice"].update(table[j][i])
                     continue
-                # свойства элемента
+                # свойства элемента: обработчик материала и правило про саму клетку
                 if self.features:
-                    if element.type == "vapor":
-                        if random.randint(0, 50) == 0:
-                            self.replace((j, i), "water")
-                    elif element.type == "acid_vapor":
-                        if random.randint(0, 35) == 0:
-                            self.replace((j, i), "acid")
-                    elif element.type == "fire":
-                        if element.temperature <= 1:
-                            self.replace((j, i), "air")
-                        else:
-                            self.board[j][i].fade()
-                        for coords in self.get_neighbors_coords((j, i)):
-                            to_fire.append(coords)
-                    elif element.type == "strong_fire":
-                        if element.temperature <= 1:
-                            self.replace((j, i), "air")
-                        else:
-                            self.board[j][i].fade()
-                        for coords in self.get_neighbors_coords((j, i)):
-                            to_strong_fire.append(coords)
-                    elif element.type in ["acid", "acid_vapor"]:
-                        for coords in self.get_neighbors_coords((j, i)):
-                            if random.randint(0, 35) == 0:
-                                if self.acid(coords):
-                                    self.replace((j, i), "air")
-                    elif element.cls == "ignitable_liquid":
-                        if element.burning:
-                            for coords in self.get_neighbors_coords((j, i)):
-                                to_fire.append(coords)
-                                to_fire_on_burning.append(coords)
-                            if random.randint(0, element.extinct_chance) == 0:
-                                self.replace((j, i), "air")
-                    elif element.cls in ["ignitable_solid", "ignitable_falling"]:
-                        if element.burning:
-                            to_fade.append((j, i))
-                            self.board[j][i].random_burning_color()
-                            for coords in self.get_neighbors_coords((j, i)):
-                                to_fire.append(coords)
-                                to_fire_on_burning.append(coords)
-                            if random.randint(0, element.extinct_chance) == 0:
-                                self.replace((j, i), "air")
-                    elif element.type == "salt":
-                        neighbors = self.get_neighbors_coords((j, i))
-                        if "water" in [self.board[x[0]][x[1]].type for x in neighbors]:
-                            for coords in neighbors:
-                                to_salt.append(coords)
-                            if random.randint(0, 2) == 0:
-                                self.replace((j, i), "air")
-                    elif element.type == "ice":
-                        neighbors = self.get_neighbors_coords((j, i))
-                        if "water" in [self.board[x[0]][x[1]].type for x in neighbors]:
-                            for coords in neighbors:
-                                to_ice.append(coords)
-                    elif element.type == "explosion_wave":
-                        if element.life_tick <= 0 or element.range <= 0:
-                            self.replace((j, i), "air")
-                        else:
-                            self.board[j][i].fade()
-                            to_expwave.append((j, i))
-                            for coords in self.get_neighbors_coords((j, i)):
-                                to_fire.append(coords)
-                    elif element.type == "wick":
-                        if element.activated:
-                            for coords in self.get_neighbors_coords((j, i)):
-                                to_fire.append(coords)
-                            self.replace((j, i), "air")
-                    elif element.type == "liquid_nitrogen":
-                        for coords in self.get_neighbors_coords((j, i)):
-                            to_freeze.append(coords)
-                        if random.randint(0, 110) == 0:
-                            self.replace((j, i), "nitrogen")
-                    elif element.type == "nitrogen":
-                        if random.randint(0, 10) == 0:
-                            self.replace((j, i), "air")
-                    elif element.type == "liquid_wax":
-                        if random.randint(0, 50) == 0 and ((j + 1, i) not in self.get_neighbors_coords((j, i)) or
-                                                           self.board[j + 1][i].weight >= element.weight):
-                            self.replace((j, i), "wax")
-                    elif element.type == "lava":
-                        neighbors = self.get_neighbors_coords((j, i))
-                        if any([self.board[x[0]][x[1]].type != 'lava' for x in neighbors]):
-                            for coords in neighbors:
-                                to_strong_fire.append(coords)
-                                to_lava.append(coords)
-
-                # физика элемента
-                if self.physics:
-                    if element.cls in ["falling", "ignitable_falling"]:
-                        if j != self.height - 1:
-                            if element.weight > self.board[j + 1][i].weight:
-                                to_switch.append(((j, i), (j + 1, i)))
-                    elif element.cls in ["liquid", "gas", "ignitable_liquid"]:
-                        flag = True
-                        if j != self.height - 1:
-                            if element.weight > self.board[j + 1][i].weight:
-                                to_switch.append(((j, i), (j + 1, i)))
-                                flag = False
-                            else:
-                                d_step_r_l = []
-                                if i != 0:
-                                    if element.weight > self.board[j + 1][i - 1].weight:
-                                        d_step_r_l.append(-1)
-                                if i != self.width - 1:
-                                    if element.weight > self.board[j + 1][i + 1].weight:
-                                        d_step_r_l.append(1)
-                                if d_step_r_l:
-                                    to_switch.append(((j, i), (j + 1, i + random.choice(d_step_r_l))))
-                                    flag = False
-                        if flag:
-                            step_r_l = []
-                            if i != 0:
-                                if self.board[j][i - 1].weight < element.weight:
-                                    step_r_l.append(-1)
-                            if i != self.width - 1:
-                                if self.board[j][i + 1].weight < element.weight:
-                                    step_r_l.append(1)
-                            if step_r_l:
-                                to_switch.append(((j, i), (j, i + random.choice(step_r_l))))
+                    code = element.code
+                    if handlers[code] is not None:
+                        handlers[code](j, i, element)
+                    rule = self_rules[code]
+                    if rule is not None and self.random.randint(0, rule[0]) == 0:
+                        self.replace((j, i), rule[2])
+
+        if profiler is not None:
+            profiler.end("scan", (window[1] - window[0]) * (window[3] - window[2]))
+
+        # физика элемента
+        if self.physics:
+            y0, y1, x0, x1 = outer
+            rows = [row[x0:x1] for row in self.board[y0:y1]]
+            weight = np.array([[element.weight for element in row] for row in rows], dtype=np.int16)
+            mobility = np.zeros((y1 - y0, x1 - x0), dtype=np.int8)
+            mobility[window[0] - y0:window[1] - y0, window[2] - x0:window[3] - x0] = [
+                [0 if element.freezed else element.mobility for element in row[window[2]:window[3]]]
+                for row in self.board[window[0]:window[1]]]
+            perm = physics_moves(weight, mobility, self.rng)
+            if perm is not None:
+                cells = [element for row in rows for element in row]
+                for j, row in enumerate(perm.tolist()):
+                    self.board[y0 + j][x0:x1] = [cells[k] for k in row]
+                self.count_moves(outer, perm, cells)
+                heat = self.heat[y0:y1, x0:x1]
+                heat[...] = heat.reshape(-1)[perm.reshape(-1)].reshape(heat.shape)
+            if profiler is not None:
+                profiler.end("switch", profiler.moved(perm))
 
         # Преимущества происходящих событий во время одного тика
 
-        for co in to_switch:
-            self.switch(co[0], co[1])
+        for phase in ACTION_PHASES:
+            if phase in self.phase_actions:
+                action = getattr(self, self.phase_actions[phase])
+                for co in queues[phase]:
+                    action(co)
+            else:
+                for co in queues[phase]:
+                    self.react(phase, co)
+            if profiler is not None:
+                profiler.end(phase, len(queues[phase]))
+
+        # тепло: теплопроводность и переходы по порогам (окно без источников и без тепла пропускается)
+        if self.features and (present & HEAT_TYPES or self.heat[outer[0]:outer[1], outer[2]:outer[3]].any()):
+            cells = self.conduct(window, outer, present)
+            if profiler is not None:
+                profiler.end("heat", cells)
+
+    def conduct(self, window, outer, present):
+        # Тепло считается только в прямоугольнике вокруг источников и нагретых клеток (heat_box);
+        # флаг горения читается только у горючих клеток. Возвращает, сколько клеток окна посчитано
+        y0, y1, x0, x1 = outer
+        codes = self.codes(outer)
+        burning = np.zeros(codes.shape, dtype=bool)
+        if present & set(BURNING_TYPES):
+            ys, xs = np.nonzero(material_table(*BURNING_TYPES)[codes])
+            burning[ys, xs] = [self.board[y][x].burning for y, x in zip((ys + y0).tolist(), (xs + x0).tolist())]
+        box = heat_box((self.heat[y0:y1, x0:x1] != 0) | MAT_HEAT_SOURCE[codes] | burning)
+        if box is None:
+            return 0
+        region = (y0 + box[0], y0 + box[1], x0 + box[2], x0 + box[3])
+        cells = (slice(region[0], region[1]), slice(region[2], region[3]))
+        core = np.zeros((box[1] - box[0], box[3] - box[2]), dtype=bool)
+        core[max(0, window[0] - region[0]):max(0, window[1] - region[0]),
+             max(0, window[2] - region[2]):max(0, window[3] - region[2])] = True
+        codes = codes[box[0]:box[1], box[2]:box[3]]
+        heat = conduct_heat(pin_heat(self.heat[cells], codes, burning[box[0]:box[1], box[2]:box[3]]), codes)
+        for m_type, above, threshold, chance, result in HEAT_TRANSITIONS:
+            if m_type not in present:
+                continue
+            changed = core & (codes == MATERIAL_CODES[m_type]) & ((heat > threshold) if above else (heat < threshold))
+            for j, i in zip(*np.nonzero(changed)):
+                if not chance or self.random.randint(0, chance) == 0:
+                    self.replace((region[0] + j, region[2] + i), result)
+        self.heat[cells][core] = heat[core]
+        return np.count_nonzero(core)
+
+    def generate_material(self, m_type):
+        return MATERIAL_REGISTRY.create(m_type, self.random)
+
+    def overlay_lines(self):
+        # строки под счетчиком FPS: замеры тика и состав поля
+        if self.profiler is None:
+            return []
+        return self.profiler.lines() + [f"{m_type}: {count}" for m_type, count in self.composition()]
+
+
+class GridBoard(Board):
+    # Поле, в котором клетки хранятся не объектами GameObjects, а параллельными массивами numpy
+    engine = "grid"
+    ignitable = material_table("oil", "wood", "coal", "sawdust")
+    ignitable_sf = material_table("wood", "coal", "sawdust")
+    # цвета горящих и потухших материалов: тип -> (цвет, разброс цвета)
+    burning_colors = {"wood": ((20, 14, 11), 10), "coal": ((56, 50, 45), 10), "sawdust": ((20, 14, 11), 10)}
+
+    def __init__(self, width, height, seed=None):
+        self.workers = 0
+        self.pool = None
+        self.shared = []
+        self.mapped = False
+        super().__init__(width, height, seed)
+
+    def clear(self):
+        # массивы очищаются на месте: они могут лежать в общей памяти процессов
+        for name, dtype, dims in GRID_FIELDS:
+            if getattr(self, name, None) is None:
+                setattr(self, name, np.zeros((self.height, self.width) + dims, dtype=dtype))
+            else:
+                getattr(self, name)[...] = 0
+        self.weight[:] = MAT_WEIGHT[MATERIAL_CODES["air"]]
+        self.count_all()
+        self.wake_all()
+
+    def save(self, path):
+        if self.mapped:
+            # массивы еще смотрят в файл прошлого снимка, который сейчас может быть заменен
+            self.set_cell_arrays({name: np.array(field) for name, field in self.cell_arrays().items()})
+            self.mapped = False
+        super().save(path)
+
+    def load(self, path):
+        # массивы поля остаются отображением файла: большой снимок открывается сразу, без чтения
+        workers = self.workers
+        if workers:
+            self.set_workers(0)
+        super().load(path)
+        self.mapped = True
+        if workers:
+            self.set_workers(workers, self.workers_seed)
+
+    def cell_arrays(self):
+        return {name: getattr(self, name) for name, dtype, dims in GRID_FIELDS}
+
+    def set_cell_arrays(self, fields):
+        for name, dtype, dims in GRID_FIELDS:
+            setattr(self, name, fields[name])
+
+    def set_workers(self, workers, seed=None):
+        # Параллельный тик: массивы поля переносятся в общую память, и блоки block_size x block_size
+        # обновляются пулом процессов в четыре фазы шахматным порядком, так что одновременно
+        # обновляемые блоки никогда не касаются клеток друг друга. Случайные числа каждого блока
+        # берутся из генератора от (seed, номер тика, блок), поэтому результат зависит только от seed.
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+            for name, dtype, dims in GRID_FIELDS:
+                setattr(self, name, getattr(self, name).copy())
+            for memory in self.shared:
+                memory.close()
+                memory.unlink()
+            self.shared = []
+        self.workers = workers
+        if not workers:
+            return
+        self.workers_seed = int(self.rng.integers(2 ** 31)) if seed is None else seed
+        self.block_size = self.chunk_size * 4
+        for name, dtype, dims in GRID_FIELDS:
+            field = getattr(self, name)
+            memory = shared_memory.SharedMemory(create=True, size=max(1, field.nbytes))
+            shared = np.ndarray(field.shape, dtype=field.dtype, buffer=memory.buf)
+            shared[...] = field
+            setattr(self, name, shared)
+            self.shared.append(memory)
+        self.pool = multiprocessing.Pool(workers, initializer=grid_worker_init,
+                                         initargs=([memory.name for memory in self.shared],
+                                                   self.width, self.height, self.chunk_size, kernel_backend))
+
+    def tick_board(self):
+        if self.pause or not self.workers:
+            super().tick_board()
+            return
+        self.ticks += 1
+        if self.profiler is not None:
+            # фазы считаются в процессах пула, здесь виден только общий тик
+            self.profiler.new_tick()
+        bs = self.block_size
+        blocks_awake = np.ones((-(-self.height // bs), -(-self.width // bs)), dtype=bool)
+        if self.scheduler:
+            due = self.due_chunks()
+            for by, bx in np.ndindex(*blocks_awake.shape):
+                blocks_awake[by, bx] = due[self.window_chunks(self.block(by, bx))].any()
+        touched = np.zeros_like(self.awake)
+        simulated = np.zeros_like(self.awake)
+        for phase_y, phase_x in ((0, 0), (0, 1), (1, 0), (1, 1)):
+            tasks = [(self.workers_seed, self.ticks, self.block(by, bx), self.features, self.physics)
+                     for by, bx in zip(*np.nonzero(blocks_awake))
+                     if by % 2 == phase_y and bx % 2 == phase_x]
+            for chunks, task in zip(self.pool.map(grid_worker_tick, tasks), tasks):
+                touched[chunks] = True
+                simulated[self.window_chunks(task[2])] = True
+                self.count_region(max(0, task[2][0] - 2), task[2][1] + 2, max(0, task[2][2] - 2), task[2][3] + 2)
+        self.resolve_blasts()
+        if self.scheduler:
+            self.update_chunks(touched, simulated)
+        if self.profiler is not None:
+            self.profiler.end_tick()
+
+    def block(self, by, bx):
+        bs = self.block_size
+        return by * bs, min(self.height, (by + 1) * bs), bx * bs, min(self.width, (bx + 1) * bs)
+
+    def view(self, outer):
+        # такое же поле, но поверх части массивов: все изменения пишутся в исходное поле
+        y0, y1, x0, x1 = outer
+        view = object.__new__(GridBoard)
+        view.__dict__.update(self.__dict__)
+        view.height, view.width = y1 - y0, x1 - x0
+        for name, dtype, dims in GRID_FIELDS:
+            setattr(view, name, getattr(self, name)[y0:y1, x0:x1])
+        return view
+
+    def snapshot(self, outer):
+        y0, y1, x0, x1 = outer
+        return [getattr(self, name)[y0:y1, x0:x1].copy() for name in ("mat", "color", "burning", "activated")]
+
+    def changed_cells(self, outer, before):
+        y0, y1, x0, x1 = outer
+        mat, color, burning, activated = before
+        return (self.mat[y0:y1, x0:x1] != mat) | (self.color[y0:y1, x0:x1] != color).any(axis=2) | \
+            (self.burning[y0:y1, x0:x1] != burning) | (self.activated[y0:y1, x0:x1] != activated)
+
+    def restless(self, region):
+        y0, y1, x0, x1 = region
+        return bool((material_table(*RESTLESS_TYPES)[self.mat[y0:y1, x0:x1]] | self.freezed[y0:y1, x0:x1] |
+                     self.burning[y0:y1, x0:x1] | self.activated[y0:y1, x0:x1] |
+                     (self.heat[y0:y1, x0:x1] != 0)).any())
+
+    def render(self, surf):
+        if self.render_mode == "dirty":
+            return self.render_dirty(surf)
+        if self.render_mode == "pixels":
+            return self.render_pixels(surf)
+        y0, y1, x0, x1 = self.visible()
+        for j, row in enumerate(self.color[y0:y1, x0:x1].tolist()):
+            for i, color in enumerate(row):
+                pygame.draw.rect(surf, color=color, rect=(
+                    self.left + i * self.cell_size,
+                    self.top + j * self.cell_size,
+                    self.cell_size,
+                    self.cell_size))
+        return [self.get_rect()]
+
+    def color_buffer(self, region=None):
+        y0, y1, x0, x1 = region or (0, self.height, 0, self.width)
+        return self.color[y0:y1, x0:x1]
 
-        for co in to_fire:
-            self.fire(co)
+    def render_dirty(self, surf):
+        color = self.color_buffer(self.visible())
+        if self.drawn is None:
+            self.drawn = color.copy()
+            changed = np.ones(color.shape[:2], dtype=bool)
+        else:
+            changed = (color != self.drawn).any(axis=2)
+            self.drawn[changed] = color[changed]
+        ys, xs = np.nonzero(changed)
+        rects = []
+        for j, i, cell_color in zip(ys.tolist(), xs.tolist(), color[ys, xs].tolist()):
+            rects.append(pygame.draw.rect(surf, color=cell_color, rect=(
+                self.left + i * self.cell_size,
+                self.top + j * self.cell_size,
+                self.cell_size,
+                self.cell_size)))
+        return self.changed_rects(rects)
 
-        for co in to_strong_fire:
-            self.strong_fire(co)
+    def on_click(self, cell_pos):
+        if cell_pos is None:
+            return
+        x, y = cell_pos
+        self.wake(y - self.brush // 2, y + self.brush // 2 + 1, x - self.brush // 2, x + self.brush // 2 + 1)
+        mask = np.zeros((self.height, self.width), dtype=bool)
+        mask[max(0, y - self.brush // 2):y + self.brush // 2 + 1,
+             max(0, x - self.brush // 2):x + self.brush // 2 + 1] = True
+        self.spawn(mask, self.current_material)
+        self.count_region(y - self.brush // 2, y + self.brush // 2 + 1, x - self.brush // 2, x + self.brush // 2 + 1)
+
+    def fill(self, x, y, width, height, material_id):
+        self.wake(y, y + height, x, x + width)
+        mask = np.zeros((self.height, self.width), dtype=bool)
+        mask[max(0, y):max(0, y + height), max(0, x):max(0, x + width)] = True
+        self.spawn(mask, material_id)
+        self.count_region(y, y + height, x, x + width)
 
-        for co in to_lava:
-            self.set_fire_on_burning(co, 120)
+    def switch(self, cell1, cell2):
+        for name, dtype, dims in GRID_FIELDS:
+            field = getattr(self, name)
+            field[cell1], field[cell2] = field[cell2].copy(), field[cell1].copy()
+        self.count_cell(cell1)
+        self.count_cell(cell2)
 
-        for co in to_expwave:
-            self.explosion_wave(co)
+    def replace(self, cell, material_id):
+        # одна клетка: поля пишутся по ее индексу, маска размером с поле не нужна
+        self.spawn_cells([cell[0]], [cell[1]], material_id)
+        self.count_cell(cell)
 
-        for co in to_fire_on_burning:
-            self.set_fire_on_burning(co, 20)
+    def eq_replace(self, coords1, coords2):
+        for name, dtype, dims in GRID_FIELDS:
+            getattr(self, name)[coords2] = getattr(self, name)[coords1]
+        self.count_cell(coords2)
 
-        for co in to_fade:
-            self.fade(co)
+    def count_cell(self, cell):
+        # счетчики чанка клетки: по ним tick_cells решает, какие ветки материалов вообще считать
+        self.count_region(cell[0], cell[0] + 1, cell[1], cell[1] + 1)
 
-        for co in to_salt:
-            self.salt(co)
+    def get_neighbors_coords(self, cell):
+        # сеточному тику соседи по одной клетке не нужны, поэтому таблицу соседей он не строит
+        return [(cell[0] + dy, cell[1] + dx) for dy, dx in NEIGHBORS_OFFSETS
+                if 0 <= cell[0] + dy < self.height and 0 <= cell[1] + dx < self.width]
 
-        for co in to_ice:
-            self.ice(co)
+    def get_air_neighbors_coords(self, cell):
+        return [x for x in self.get_neighbors_coords(cell) if self.mat[x] == MATERIAL_CODES["air"]]
+
+    def spawn(self, mask, material_id):
+        self.spawn_cells(*np.nonzero(mask), material_id)
+
+    def spawn_cells(self, ys, xs, material_id):
+        m_type, temperature, power, wave_range = GRID_SPAWNS.get(material_id, (material_id, 0, 0, 0))
+        code = MATERIAL_CODES[m_type]
+        if self.profiler is not None and len(ys):
+            for old, count in zip(*np.unique(self.mat[ys, xs], return_counts=True)):
+                self.profiler.replaced(MATERIAL_TYPES[old], int(count))
+        self.mat[ys, xs] = code
+        self.weight[ys, xs] = MAT_WEIGHT[code]
+        self.temperature[ys, xs] = temperature
+        self.life_tick[ys, xs] = 2 if m_type == "explosion_wave" else 0
+        self.power[ys, xs] = power
+        self.range[ys, xs] = wave_range
+        self.burning[ys, xs] = False
+        self.freezed[ys, xs] = False
+        self.activated[ys, xs] = False
+        if m_type == "explosion_wave":
+            self.color[ys, xs] = gradient_color((255, 106, 0), (0, 0, 0), wave_range * 25)
+        elif MAT_COLOR_MODIFIER[code]:
+            self.color[ys, xs] = self.approximate_colors(MAT_COLOR[code], MAT_COLOR_MODIFIER[code], len(ys))
+        else:
+            self.color[ys, xs] = MAT_COLOR[code]
+
+    def blast_sources(self):
+        ys, xs = np.array(self.cells_of("explosion_wave"), dtype=np.intp).reshape(-1, 2).T
+        fresh = self.power[ys, xs] > 0
+        ys, xs = ys[fresh], xs[fresh]
+        return list(zip(ys.tolist(), xs.tolist(), self.power[ys, xs].tolist(), self.range[ys, xs].tolist()))
+
+    def durabilities(self, region):
+        y0, y1, x0, x1 = region
+        return np.where(self.freezed[y0:y1, x0:x1], 0, MAT_DURABILITY[self.mat[y0:y1, x0:x1]])
+
+    def set_rings(self, region, reached, ranges):
+        view = self.view(region)
+        view.spawn(reached, "explosion_wave_gp")
+        view.power[reached] = 0
+        view.range[reached] = ranges[reached]
+        view.color[reached] = self.gradient_colors((255, 106, 0), (0, 0, 0), ranges[reached] * 25)
+        self.count_region(*region)
+
+    def approximate_colors(self, color, max_color_modifier, count):
+        color_modifier = self.rng.integers(-max_color_modifier, max_color_modifier + 2, count)
+        return np.clip(np.asarray(color, dtype=np.int16) + color_modifier[:, None], 0, 255)
+
+    @staticmethod
+    def gradient_colors(c1, c2, p):
+        p = np.clip(p, 0, 100).astype(np.int32)[:, None]
+        return (np.asarray(c1) * p + np.asarray(c2) * (100 - p)) // 100
+
+    def freeze_cells(self, mask):
+        ys, xs = np.nonzero(mask)
+        self.original_color[ys, xs] = self.color[ys, xs]
+        self.color[ys, xs] = self.gradient_colors((214, 243, 255), self.color[ys, xs], np.full(len(ys), 40))
+        self.weight[ys, xs] = 20
+        self.freezed[ys, xs] = True
+
+    def unfreeze_cells(self, mask):
+        ys, xs = np.nonzero(mask)
+        self.color[ys, xs] = self.original_color[ys, xs]
+        self.weight[ys, xs] = MAT_WEIGHT[self.mat[ys, xs]]
+        self.freezed[ys, xs] = False
+
+    def is_type(self, *types):
+        return material_table(*types)[self.mat]
+
+    def roll(self, mask, chance):
+        # аналог random.randint(0, chance) == 0 для каждой клетки маски
+        result = np.zeros_like(mask)
+        ys, xs = np.nonzero(mask)
+        lucky = self.rng.random(len(ys)) * (np.asarray(chance) + 1) < 1
+        result[ys[lucky], xs[lucky]] = True
+        return result
 
-        for co in to_freeze:
-            self.freeze(co)
+    def offset_slices(self, dy, dx):
+        # срезы (клетки, их соседи со смещением (dy, dx))
+        h, w = self.height, self.width
+        return ((slice(max(0, -dy), h - max(0, dy)), slice(max(0, -dx), w - max(0, dx))),
+                (slice(max(0, dy), h - max(0, -dy)), slice(max(0, dx), w - max(0, -dx))))
+
+    def near(self, mask):
+        result = np.zeros_like(mask)
+        for dy, dx in NEIGHBORS_OFFSETS:
+            cells, neighbors = self.offset_slices(dy, dx)
+            result[cells] |= mask[neighbors]
+        return result
 
-    def generate_material(self, m_type):
-        return {"air": Sandbox.GameObjects.Air(), "sand": Sandbox.GameObjects.Sand(),
-                "water": Sandbox.GameObjects.Water(), "iron": Sandbox.GameObjects.Iron(),
-                "vapor": Sandbox.GameObjects.Vapor(), "fire_4": Sandbox.GameObjects.Fire(4),
-                "acid": Sandbox.GameObjects.Acid(), "acid_vapor": Sandbox.GameObjects.AVapor(),
-                "dirt": Sandbox.GameObjects.Dirt(), "oil": Sandbox.GameObjects.Oil(),
-                "wood": Sandbox.GameObjects.Wood(), "coal": Sandbox.GameObjects.Coal(),
-                "fire_5": Sandbox.GameObjects.Fire(5), "salt": Sandbox.GameObjects.Salt(),
-                "salt_water": Sandbox.GameObjects.SWater(), "ice": Sandbox.GameObjects.Ice(),
-                "snow": Sandbox.GameObjects.Snow(), "gunpowder": Sandbox.GameObjects.Gunpowder(),
-                "explosion_wave_gp": Sandbox.GameObjects.ExplosionWave(4, 4),
-                "explosion_wave_5_5": Sandbox.GameObjects.ExplosionWave(5, 5),
-                "sawdust": Sandbox.GameObjects.Sawdust(), "methane": Sandbox.GameObjects.Methane(),
-                "wick": Sandbox.GameObjects.Wick(), "liquid_nitrogen": Sandbox.GameObjects.LNitrogen(),
-                "nitrogen": Sandbox.GameObjects.Nitrogen(), "wax": Sandbox.GameObjects.Wax(),
-                "liquid_wax": Sandbox.GameObjects.LWax(), "stone": Sandbox.GameObjects.Stone(),
-                "strong_fire": Sandbox.GameObjects.StrongFire(5), "lava": Sandbox.GameObjects.Lava(),
-                "tnt": Sandbox.GameObjects.Tnt(), "explosion_wave_tnt": Sandbox.GameObjects.ExplosionWave(5, 6)}[m_type]
+    def tick_region(self, window, outer):
+        core = np.zeros((outer[1] - outer[0], outer[3] - outer[2]), dtype=bool)
+        core[window[0] - outer[0]:window[1] - outer[0], window[2] - outer[2]:window[3] - outer[2]] = True
+        # в процессах пула счетчиков нет: их пересчитывает основной процесс после тика
+        present = None if self.population is None else self.present(outer)
+        if outer == (0, self.height, 0, self.width):
+            self.tick_cells(core, present)
+        else:
+            self.view(outer).tick_cells(core, present)
+        if self.population is not None:
+            self.count_region(*outer)
+
+    def codes(self, region):
+        y0, y1, x0, x1 = region
+        return self.mat[y0:y1, x0:x1]
+
+    def tick_cells(self, core, present=None):
+        # тик для клеток маски core, остальные клетки только служат соседями;
+        # present - материалы окна по счетчикам, ветки отсутствующих материалов пропускаются
+        shape = (self.height, self.width)
+        present = set(MATERIAL_TYPES) if present is None else present
+        queues = {phase: np.zeros(shape, dtype=bool) for phase in ACTION_PHASES}
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin()
+
+        freezed = self.freezed & core
+        if "water" in present and freezed.any():
+            queues["ice"] |= self.near(freezed & self.near(self.is_type("water")))
+        live = ~self.freezed & core
+        # свойства элемента
+        if self.features:
+            for m_type, c1, c2 in (("fire", (222, 89, 22), (61, 12, 12)),
+                                   ("strong_fire", (30, 144, 255), (12, 16, 61))):
+                if m_type not in present:
+                    continue
+                fire = live & self.is_type(m_type)
+                queues["fire"] |= self.near(fire)
+                self.spawn(fire & (self.temperature <= 1), "air")
+                fading = fire & (self.temperature > 1)
+                self.temperature[fading] -= 1
+                self.color[fading] = self.gradient_colors(c1, c2, self.temperature[fading] * 20)
+
+            acid = live & self.is_type("acid")
+            if acid.any():
+                for dy, dx in NEIGHBORS_OFFSETS:
+                    cells, neighbors = self.offset_slices(dy, dx)
+                    target = np.zeros(shape, dtype=bool)
+                    target[neighbors] = acid[cells]
+                    mat = self.mat.copy()
+                    hit = self.react("acid", target)
+                    for code in np.unique(mat[hit]):
+                        dissolved = np.zeros(shape, dtype=bool)
+                        dissolved[cells] = (hit & (mat == code))[neighbors]
+                        self.spawn(dissolved, REACTIONS["acid"][code][1])
+
+            burning = live & self.burning & self.ignitable[self.mat]
+            if burning.any():
+                queues["fade"] |= burning & self.ignitable_sf[self.mat]
+                for m_type, (color, max_color_modifier) in self.burning_colors.items():
+                    ys, xs = np.nonzero(burning & self.is_type(m_type))
+                    self.color[ys, xs] = self.approximate_colors(color, max_color_modifier, len(ys))
+                queues["fire"] |= self.near(burning)
+                queues["fire_on_burning"] |= self.near(burning)
+                self.spawn(self.roll(burning, MAT_EXTINCT_CHANCE[self.mat[burning]]), "air")
+
+            if "water" in present and present & {"salt", "ice"}:
+                water = self.is_type("water")
+                salt = live & self.is_type("salt") & self.near(water)
+                queues["salt"] |= self.near(salt)
+                self.spawn(self.roll(salt, 2), "air")
+                queues["ice"] |= self.near(live & self.is_type("ice") & self.near(water))
+
+            if "explosion_wave" in present:
+                wave = live & self.is_type("explosion_wave") & (self.power == 0)
+                self.spawn(wave & (self.life_tick <= 0), "air")
+                wave &= self.is_type("explosion_wave")
+                self.life_tick[wave] -= 1
+                queues["fire"] |= self.near(wave)
+
+            if "wick" in present:
+                wick = live & self.is_type("wick") & self.activated
+                queues["fire"] |= self.near(wick)
+                self.spawn(wick, "air")
+
+            if "liquid_nitrogen" in present:
+                queues["freeze"] |= self.near(live & self.is_type("liquid_nitrogen"))
+
+            if "liquid_wax" in present:
+                wax = self.roll(live & self.is_type("liquid_wax"), 50)
+                wax[:-1] &= self.weight[1:] >= self.weight[:-1]
+                self.spawn(wax, "wax")
+
+            if "lava" in present:
+                lava = live & self.is_type("lava")
+                lava &= self.near(~self.is_type("lava"))
+                queues["fire"] |= self.near(lava)
+                queues["lava"] |= self.near(lava)
+
+            # правила про саму клетку (пар конденсируется, азот испаряется...)
+            self.react("self", live)
+
+        if profiler is not None:
+            profiler.end("scan", np.count_nonzero(core))
+
+        # физика элемента
+        if self.physics:
+            perm = physics_moves(self.weight, np.where(live, MAT_MOBILITY[self.mat], 0), self.rng)
+            if perm is not None:
+                self.permute(perm.reshape(-1))
+            if profiler is not None:
+                profiler.end("switch", profiler.moved(perm))
+
+        # Преимущества происходящих событий во время одного тика
+
+        for phase in ACTION_PHASES:
+            if phase in self.phase_actions:
+                getattr(self, self.phase_actions[phase])(queues[phase])
+            else:
+                self.react(phase, queues[phase])
+            if profiler is not None:
+                profiler.end(phase, np.count_nonzero(queues[phase]))
+
+        # тепло: теплопроводность и переходы по порогам (окно без источников и без тепла пропускается)
+        if self.features and (present & HEAT_TYPES or self.heat[core].any()):
+            cells = self.conduct_cells(core, present)
+            if profiler is not None:
+                profiler.end("heat", cells)
+
+    def conduct_cells(self, core, present):
+        # тепло считается только в прямоугольнике вокруг источников и нагретых клеток (heat_box)
+        box = heat_box((self.heat != 0) | MAT_HEAT_SOURCE[self.mat] | self.burning)
+        if box is None:
+            return 0
+        view = self.view(box)
+        core = core[box[0]:box[1], box[2]:box[3]]
+        mat = view.mat.copy()
+        heat = conduct_heat(pin_heat(view.heat, mat, view.burning), mat)
+        for m_type, above, threshold, chance, result in HEAT_TRANSITIONS:
+            if m_type not in present:
+                continue
+            changed = core & (mat == MATERIAL_CODES[m_type]) & ((heat > threshold) if above else (heat < threshold))
+            view.spawn(view.roll(changed, chance) if chance else changed, result)
+        view.heat[core] = heat[core]
+        return np.count_nonzero(core)
+
+    def permute(self, perm):
+        for name, dtype, dims in GRID_FIELDS:
+            field = getattr(self, name)
+            field[...] = field.reshape((-1,) + dims)[perm].reshape(field.shape)
+
+    def fire(self, mask):
+        if not mask.any():
+            return
+        freezed = mask & self.freezed
+        self.unfreeze_cells(freezed)
+        mask = mask & ~freezed
+        mat = self.mat.copy()
+        neighbors_air = self.near(mat == MATERIAL_CODES["air"])
+        wet = self.near(material_table("water", "vapor", "salt_water", "liquid_nitrogen")[mat])
+        ignite = mask & self.ignitable[mat] & neighbors_air & ~wet
+        self.burning[ignite] = True
+        self.color[ignite & (mat == MATERIAL_CODES["oil"])] = (252, 228, 167)
+
+        salt_water = mask & (mat == MATERIAL_CODES["salt_water"])
+        to_salt = self.roll(salt_water & neighbors_air, 3)
+        pending = to_salt.copy()
+        for k in self.rng.permutation(len(NEIGHBORS_OFFSETS)):
+            cells, neighbors = self.offset_slices(*NEIGHBORS_OFFSETS[k])
+            vapor = np.zeros_like(mask)
+            vapor[neighbors] = pending[cells] & (self.mat[neighbors] == MATERIAL_CODES["air"])
+            pending[cells] &= ~vapor[neighbors]
+            self.spawn(vapor, "vapor")
+        self.spawn(salt_water & ~to_salt, "vapor")
+        self.spawn(to_salt, "salt")
+
+        self.react("fire", mask)
+        wick = mask & (mat == MATERIAL_CODES["wick"])
+        self.activated[wick] = True
+        self.color[wick] = self.approximate_colors((245, 110, 0), 5, np.count_nonzero(wick))
+
+    def react(self, source, mask):
+        # правила REACTIONS[source] для клеток маски, возвращает маску сработавших
+        chance = REACTION_CHANCES[source][self.mat]
+        hit = mask & (chance >= 0)
+        if not hit.any():
+            return hit
+        hit = self.roll(hit, chance[hit])
+        groups = [(code, hit & (self.mat == code)) for code in np.unique(self.mat[hit])]
+        for code, cells in groups:
+            self.spawn(cells, REACTIONS[source][code][2])
+        return hit
+
+    def fade(self, mask):
+        burning = mask & self.ignitable_sf[self.mat] & self.burning
+        if not burning.any():
+            return
+        mat = self.mat
+        no_air = ~self.near(material_table("air", "fire")[mat])
+        wet = self.near(material_table("salt_water", "water", "vapor", "liquid_nitrogen")[mat])
+        self.burning[burning & (no_air | wet)] = False
+
+    def freeze(self, mask):
+        mask = mask & ~self.freezed
+        if not mask.any():
+            return
+        mat = self.mat.copy()
+        burning = mask & self.ignitable[mat] & self.burning
+        self.burning[burning] = False
+        oil = burning & (mat == MATERIAL_CODES["oil"])
+        self.color[oil] = self.approximate_colors((25, 22, 31), 2, np.count_nonzero(oil))
+        self.react("freeze", mask)
+        self.freeze_cells(mask & MAT_CAN_BE_FREEZED[mat])
+
+
+worker_board = None
+worker_memory = []
+
+
+def grid_worker_init(names, width, height, chunk_size, kernels):
+    # процесс пула открывает массивы поля из общей памяти и берет те же ядра тика, что и главный процесс
+    global worker_board, worker_memory
+    set_kernels(kernels)
+    worker_memory = [shared_memory.SharedMemory(name=name) for name in names]
+    worker_board = object.__new__(GridBoard)
+    worker_board.width, worker_board.height = width, height
+    worker_board.chunk_size = chunk_size
+    worker_board.profiler = None
+    worker_board.population = None
+    for (name, dtype, dims), memory in zip(GRID_FIELDS, worker_memory):
+        setattr(worker_board, name, np.ndarray((height, width) + dims, dtype=dtype, buffer=memory.buf))
+
+
+def grid_worker_tick(task):
+    seed, tick, window, features, physics = task
+    worker_board.features, worker_board.physics = features, physics
+    worker_board.rng = np.random.default_rng([seed, tick, window[0], window[2]])
+    return worker_board.tick_tracked(window)
+
+
+class BackgroundBoard:
+    # Поле в отдельном процессе: тики идут там со своей частотой и не тормозят окно. Готовые кадры (цвета клеток)
+    # процесс пишет в две общие картинки по очереди и переключает номер последней под замком; окно только
+    # копирует последний кадр и отправляет ввод в очередь. Для окна и меню это обычное поле. Размер поля
+    # (после загрузки снимка он может стать другим) процесс тоже пишет рядом с кадром.
+    get_rect = Board.get_rect
+    get_cell = Board.get_cell
+    set_view = Board.set_view
+    pan = Board.pan
+    zoom = Board.zoom
+    visible = Board.visible
+    changed_rects = Board.changed_rects
+    set_material = Board.set_material
+    set_brush = Board.set_brush
+    set_render_mode = Board.set_render_mode
+    render_pixels = Board.render_pixels
+
+    def __init__(self, engine, width, height, seed=None, workers=0, tick_rate=30, record=None):
+        self.current_material = "air"
+        self.brush = 1
+        self.pause = False
+        self.physics = True
+        self.features = True
+        self.camera = (0, 0)
+        self.viewed = None
+        self.render_mode = "pixels"
+        self.drawn = None
+        self.pixels = None
+        self.scaled = None
+        self.profiler = None
+        self.lines = []
+        # две картинки кадра и control = [номер последнего готового кадра, номер тика, высота, ширина поля]
+        self.shared = [shared_memory.SharedMemory(create=True, size=height * width * 3) for _ in range(2)]
+        self.shared.append(shared_memory.SharedMemory(create=True, size=32))
+        self.frames = [np.ndarray((height, width, 3), dtype=np.uint8, buffer=memory.buf) for memory in self.shared[:2]]
+        self.control = np.ndarray((4,), dtype=np.int64, buffer=self.shared[2].buf)
+        self.control[:] = (0, 0, height, width)
+        self.shown = (height, width)
+        self.lock = multiprocessing.Lock()
+        self.inputs = multiprocessing.Queue()
+        self.status = multiprocessing.Queue(maxsize=1)
+        self.process = multiprocessing.Process(target=background_main, args=(
+            engine, width, height, seed, workers, tick_rate, record, [memory.name for memory in self.shared],
+            self.lock, self.inputs, self.status, kernel_backend))
+        self.process.start()
+        self.set_view(10, 10, 30)
+
+    @property
+    def ticks(self):
+        return int(self.control[1])
+
+    @property
+    def height(self):
+        return int(self.control[2])
+
+    @property
+    def width(self):
+        return int(self.control[3])
+
+    def send(self, *message):
+        self.inputs.put(message)
+
+    def record(self, action, cell=(-1, -1), brush=None):
+        # журнал пишет процесс поля, когда применяет ввод
+        pass
+
+    def move_camera(self, x, y):
+        # камера нужна и процессу поля: чанки вне нее тикают реже
+        Board.move_camera(self, x, y)
+        self.send("view", self.left, self.top, self.cell_size, self.view_width, self.view_height, self.camera)
+
+    def get_click(self, mouse_pos):
+        cell = self.get_cell(mouse_pos)
+        if cell is not None:
+            self.send("input", "paint", cell, self.current_material, self.brush)
+
+    def clear(self):
+        self.send("input", "clear", (-1, -1), self.current_material, self.brush)
+
+    def set_pause(self):
+        self.pause = not self.pause
+        self.send("input", "pause", (-1, -1), self.current_material, self.brush)
+
+    def toggle_obj_physics(self):
+        self.physics = not self.physics
+        self.send("input", "physics", (-1, -1), self.current_material, self.brush)
+
+    def toggle_obj_features(self):
+        self.features = not self.features
+        self.send("input", "features", (-1, -1), self.current_material, self.brush)
+
+    def set_tick_rate(self, tick_rate):
+        self.send("rate", tick_rate)
+
+    def set_profiler(self, enabled):
+        self.profiler = True if enabled else None
+        self.lines = []
+        self.send("profile", enabled)
+
+    def save(self, path):
+        self.send("save", path)
+
+    def load(self, path):
+        self.send("load", path)
+
+    def color_buffer(self, region=None):
+        y0, y1, x0, x1 = region or (0, self.height, 0, self.width)
+        with self.lock:
+            return self.frames[self.control[0]][y0:y1, x0:x1].copy()
+
+    def render(self, surf):
+        if (self.height, self.width) != self.shown:
+            # процесс загрузил снимок другого размера: камера и клики должны остаться в пределах нового поля
+            self.shown = (self.height, self.width)
+            self.move_camera(*self.camera)
+        return self.render_pixels(surf)
+
+    def overlay_lines(self):
+        try:
+            while True:
+                self.lines = self.status.get_nowait()
+        except queue.Empty:
+            pass
+        return self.lines if self.profiler is not None else []
+
+    def close(self):
+        self.send("quit")
+        self.process.join()
+        # после закрытия общей памяти остаются копии последнего кадра и номера тика
+        frame = self.color_buffer()
+        self.frames = [frame, frame]
+        self.control = self.control.copy()
+        for memory in self.shared:
+            memory.close()
+            memory.unlink()
+        self.shared = []
+
+
+def background_main(engine, width, height, seed, workers, tick_rate, record, names, lock, inputs, status, kernels):
+    # процесс поля для BackgroundBoard: ввод из очереди, тики с фиксированным шагом, кадры в общую память
+    set_kernels(kernels)
+    memory = [shared_memory.SharedMemory(name=name) for name in names]
+    frames = [np.ndarray((height, width, 3), dtype=np.uint8, buffer=item.buf) for item in memory[:2]]
+    control = np.ndarray((4,), dtype=np.int64, buffer=memory[2].buf)
+    board = (GridBoard if engine == "grid" else Board)(width, height, seed)
+    if workers:
+        board.set_workers(workers)
+    if record:
+        board.start_journal()
+    step = 1 / tick_rate
+    next_tick = time.perf_counter()
+    next_status = 0
+    changed = True
+    running = True
+    while running:
+        if changed:
+            back = 1 - control[0]
+            # снимок другого размера показывается в пределах окна
+            buffer = board.color_buffer()[:height, :width]
+            frames[back][:buffer.shape[0], :buffer.shape[1]] = buffer
+            with lock:
+                control[:] = (back, board.ticks) + buffer.shape[:2]
+            changed = False
+        try:
+            message = inputs.get(timeout=max(0, next_tick - time.perf_counter()))
+        except queue.Empty:
+            message = None
+        if message is None:
+            board.tick_board()
+            changed = not board.pause
+            # отставание больше пяти тиков не догоняется
+            next_tick = max(next_tick + step, time.perf_counter() - 5 * step)
+            if board.profiler is not None and time.perf_counter() >= next_status:
+                try:
+                    status.put_nowait(board.overlay_lines())
+                except queue.Full:
+                    pass
+                next_status = time.perf_counter() + 0.25
+        elif message[0] == "input":
+            action, cell, material, brush = message[1:]
+            board.set_material(material)
+            board.set_brush(brush)
+            board.record(action, cell)
+            board.apply_input(action, cell, material, brush)
+            changed = True
+        elif message[0] == "view":
+            board.set_view(*message[1:6])
+            board.move_camera(*message[6])
+        elif message[0] == "rate":
+            step = 1 / message[1]
+        elif message[0] == "profile":
+            board.set_profiler(message[1])
+        elif message[0] == "save":
+            board.save(message[1])
+        elif message[0] == "load":
+            board.load(message[1])
+            changed = True
+        elif message[0] == "quit":
+            running = False
+    if record:
+        board.save_journal(record)
+    if workers:
+        board.set_workers(0)
+    for item in memory:
+        item.close()
 
 
 class ManageMenu:
+    # кнопки меню, которые меняют поле и попадают в журнал ввода
+    journaled = {"clear": "clear", "pause": "pause", "toggle_obj_f": "features", "toggle_obj_p": "physics"}
+
     def __init__(self, board: Board, parent):
         self.link_with_board = board
         self.parent = parent
-        self.left = board.left * 2 + board.cell_size * board.width
+        self.left = board.left * 2 + board.view_width
         self.top = board.top
         self.all_sprites = pygame.sprite.Group()
         self.buttons = []
@@ -495,8 +2501,25 @@ class ManageMenu:
                                               "CT", "toggle_obj_p"))
         self.buttons.append(ManageMenu.Button(self, (5, 585), (40, 40), "slow_mo_icon.png", "CT", "slow_motion"))
 
+        # Панель рисуется один раз в свою картинку (panel) и перерисовывается, только когда меняется
+        # наведение, выбор кнопок или цвет фона. Кнопку под мышью дает таблица "пиксель панели -> номер
+        # кнопки" (-1 - нет кнопки); раньше стоящие в списке кнопки перекрывают следующие, как при переборе.
+        width = max(button.coords[0] + button.size[0] for button in self.buttons) + 1
+        height = max(button.coords[1] + button.size[1] for button in self.buttons) + 1
+        self.panel = None
+        self.panel_size = (width, height)
+        self.panel_background = None
+        self.hits = np.full((height, width), -1, dtype=np.int8)
+        for k in reversed(range(len(self.buttons))):
+            (x, y), (w, h) = self.buttons[k].coords, self.buttons[k].size
+            self.hits[y:y + h + 1, x:x + w + 1] = k
+
     def set_button_width(self, width):
         self.button_width = width
+        self.redraw()
+
+    def redraw(self):
+        self.panel_background = None
 
     class Button:
         def __init__(self, parent, coords, size, icon_name, button_type, item_id):
@@ -517,6 +2540,7 @@ class ManageMenu:
             self.parent.all_sprites.add(self.sprite)
 
         def activate(self):
+            self.parent.redraw()
             if self.button_type == 'B':
                 for btn in self.parent.buttons:
                     if btn.button_type == "B":
@@ -536,6 +2560,17 @@ class ManageMenu:
                 self.parent.custom_action(self.action)
 
     def render(self, surf):
+        background = tuple(self.parent.rainbow_color)
+        if background != self.panel_background:
+            self.draw_panel(background)
+        surf.blit(self.panel, (self.left, self.top))
+
+    def draw_panel(self, background):
+        if self.panel is None:
+            self.panel = pygame.Surface(self.panel_size)
+        surf = self.panel
+        surf.fill(background)
+        self.panel_background = background
         for button in self.buttons:
             rnbwc = self.parent.rainbow_color
             button_color_1 = rnbwc[0] + 20, rnbwc[1] + 20, rnbwc[2] + 20
@@ -547,16 +2582,17 @@ class ManageMenu:
                 button_color_1 = rnbwc[0] + 40, rnbwc[1] + 40, rnbwc[2] + 40
                 button_color_2 = rnbwc[0] + 100, rnbwc[1] + 100, rnbwc[2] + 100
             pygame.draw.rect(surf, color=button_color_1, rect=(
-                self.left + button.coords[0],
-                self.top + button.coords[1],
+                button.coords[0],
+                button.coords[1],
                 button.size[0],
                 button.size[1]))
             pygame.draw.rect(surf, color=button_color_2, rect=(
-                self.left + button.coords[0] + self.button_width,
-                self.top + button.coords[1] + self.button_width,
+                button.coords[0] + self.button_width,
+                button.coords[1] + self.button_width,
                 button.size[0] - self.button_width * 2,
                 button.size[1] - self.button_width * 2))
-        self.all_sprites.draw(surface=surf)
+        for sprite in self.all_sprites:
+            surf.blit(sprite.image, sprite.rect.move(-self.left, -self.top))
 
     def set_brush(self, size):
         self.link_with_board.set_brush(size)
@@ -565,6 +2601,8 @@ class ManageMenu:
         self.link_with_board.set_material(material_id)
 
     def custom_action(self, action_id):
+        if action_id in self.journaled:
+            self.link_with_board.record(self.journaled[action_id])
         if action_id == "clear":
             self.link_with_board.clear()
         elif action_id == "pause":
@@ -579,11 +2617,11 @@ class ManageMenu:
             self.parent.slow_motion_toggle()
 
     def get_button(self, mouse_pos):
-        for button in self.buttons:
-            if button.coords[0] + self.left <= mouse_pos[0] <= button.coords[0] + button.size[0] + self.left and \
-                    button.coords[1] + self.top <= mouse_pos[1] <= button.coords[1] + button.size[1] + self.top:
-                return button
-        return None
+        x, y = mouse_pos[0] - self.left, mouse_pos[1] - self.top
+        if not (0 <= x < self.panel_size[0] and 0 <= y < self.panel_size[1]):
+            return None
+        k = self.hits[y, x]
+        return None if k < 0 else self.buttons[k]
 
     def on_click(self, button):
         if button is None:
@@ -601,19 +2639,43 @@ class ManageMenu:
             for btn in self.buttons:
                 btn.mouse_on = False
             button.mouse_on = True
+            self.redraw()
             self.sounds[1].play()
 
 
 class Sandbox:
-    def __init__(self):
-        self.board = Board(50, 42)
+    def __init__(self, engine="objects", render_mode="full", workers=0, seed=None, profile=False, record=None,
+                 fps=60, tps=30, background=False, size=(50, 42)):
+        # для журнала ввода seed нужен всегда, иначе повтор пойдет по другим случайным числам
+        if record and seed is None:
+            seed = random.randrange(2 ** 31)
+        # background - поле тикает в отдельном процессе (BackgroundBoard), окно только рисует его кадры
+        self.background = background
+        self.record = record
+        if background:
+            self.board = BackgroundBoard(engine, size[0], size[1], seed, workers, tps, record)
+        else:
+            self.board = (GridBoard if engine == "grid" else Board)(size[0], size[1], seed)
+            if workers:
+                self.board.set_workers(workers)
+            if record:
+                self.board.start_journal()
+        self.board.set_render_mode(render_mode)
+        self.board.set_profiler(profile)
         pygame.init()
         self.size = self.width, self.height = 1040, 692
-        self.max_fps = 30
+        # кадры и тики независимы: кадров в секунду не больше max_fps, тиков поля - ровно tick_rate,
+        # сколько бы кадров ни вышло (но не больше max_ticks_per_frame за кадр, иначе отставание сбрасывается)
+        self.max_fps = fps
+        self.tick_rate = tps
+        self.normal_tick_rate = tps
+        self.max_ticks_per_frame = 5
         self.screen = pygame.display.set_mode(self.size, pygame.DOUBLEBUF)
-        self.board.set_view(2, 2, 16)
+        # поле занимает на экране 800x672 пикселей; поле больше этого смотрится через камеру
+        self.board.set_view(2, 2, 16, 800, 672)
         self.rainbow_color = pygame.Color(0)
         self.rainbow_turn = True
+        self.hue_step = 6
         self.menu = ManageMenu(self.board, self)
         self.menu.set_button_width(3)
 
@@ -627,12 +2689,28 @@ class Sandbox:
         self.board.set_material("air")
         self.board.set_brush(1)
         fps_font = pygame.font.Font(None, 32)
-        fps_pos = (self.board.left * 2 + self.board.width * self.board.cell_size, 1)
+        fps_pos = (self.board.left * 2 + self.board.view_width, 1)
+        # F3 - замеры тика по фазам под счетчиком FPS
+        profiler_font = pygame.font.Font(None, 20)
+        profiler_pos = (fps_pos[0], fps_pos[1] + 26)
 
         hue = 0
+        lag = 0
 
         while running:
-            screen.fill(self.rainbow_color)
+            # в режиме "dirty" фон заливается только вокруг поля, само поле рисует лишь изменения
+            # (видимая часть поля меняется вместе с масштабом)
+            board_rect = self.board.get_rect()
+            frame_rects = [pygame.Rect(0, 0, self.width, board_rect.top),
+                           pygame.Rect(0, board_rect.bottom, self.width, self.height - board_rect.bottom),
+                           pygame.Rect(0, board_rect.top, board_rect.left, board_rect.height),
+                           pygame.Rect(board_rect.right, board_rect.top, self.width - board_rect.right,
+                                       board_rect.height)]
+            if self.board.render_mode == "dirty":
+                for rect in frame_rects:
+                    screen.fill(self.rainbow_color, rect)
+            else:
+                screen.fill(self.rainbow_color)
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
@@ -644,21 +2722,62 @@ class Sandbox:
                     hold = False
                 if event.type == pygame.MOUSEMOTION:
                     self.menu.get_motion(event.pos)
+                # колесо мыши - масштаб вокруг клетки под курсором
+                if event.type == pygame.MOUSEWHEEL:
+                    mouse_pos = pygame.mouse.get_pos()
+                    self.board.zoom(event.y, mouse_pos if board_rect.collidepoint(mouse_pos) else None)
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    self.board.set_profiler(self.board.profiler is None)
+                # F5 - быстрое сохранение поля, F9 - загрузка
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F5:
+                    self.board.save(QUICKSAVE_PATH)
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F9 and os.path.exists(QUICKSAVE_PATH):
+                    self.board.load(QUICKSAVE_PATH)
             if hold:
                 self.board.get_click(pygame.mouse.get_pos())
-            self.board.render(screen)
+            # стрелки двигают камеру
+            keys = pygame.key.get_pressed()
+            speed = max(1, 12 // self.board.cell_size)
+            dx = (keys[pygame.K_RIGHT] - keys[pygame.K_LEFT]) * speed
+            dy = (keys[pygame.K_DOWN] - keys[pygame.K_UP]) * speed
+            if dx or dy:
+                self.board.pan(dx, dy)
+            # фиксированный шаг: набежавшее с прошлого кадра время тратится на целые тики поля
+            step = 1000 / self.tick_rate
+            lag += clock.get_time()
+            ticks = 0
+            while not self.background and lag >= step and ticks < self.max_ticks_per_frame:
+                self.board.tick_board()
+                lag -= step
+                ticks += 1
+            if lag >= step:
+                lag = 0
+            board_rects = self.board.render(screen)
             self.menu.render(screen)
-            self.board.tick_board()
             clock.tick(self.max_fps)
             fps_now = str(clock.get_fps())[:4]
             text = fps_font.render(fps_now + " FPS", True, (220, 220, 220))
 
+            # цвет фона меняется раз в hue_step кадров: на каждом шаге перерисовывается панель меню
             if self.rainbow_turn:
-                self.rainbow_color.hsla = (hue, 50, 25, 50)
+                if hue % self.hue_step == 0:
+                    self.rainbow_color.hsla = (hue, 50, 25, 50)
                 hue = hue + 1 if hue < 360 else 0
 
             screen.blit(text, fps_pos)
-            pygame.display.flip()
+            for k, line in enumerate(self.board.overlay_lines()):
+                screen.blit(profiler_font.render(line, True, (220, 220, 220)),
+                            (profiler_pos[0], profiler_pos[1] + k * profiler_font.get_linesize()))
+            if self.board.render_mode == "dirty":
+                pygame.display.update(frame_rects + board_rects)
+            else:
+                pygame.display.flip()
+        if self.background:
+            self.board.close()
+        elif self.record:
+            self.board.save_journal(self.record)
+        if isinstance(self.board, GridBoard):
+            self.board.set_workers(0)
         pygame.quit()
 
     def rainbow_change(self):
@@ -669,22 +2788,53 @@ class Sandbox:
             self.rainbow_color = (80, 80, 80)
 
     def slow_motion_toggle(self):
-        self.max_fps = {30: 10, 10: 30}[self.max_fps]
+        # замедляется только поле, интерфейс рисуется с прежней частотой
+        if self.tick_rate == self.normal_tick_rate:
+            self.tick_rate = max(1, self.normal_tick_rate // 3)
+        else:
+            self.tick_rate = self.normal_tick_rate
+        if self.background:
+            self.board.set_tick_rate(self.tick_rate)
 
     class GameObjects:
+        # Клетки движка objects. Все, что одинаково у всех клеток материала (тип, класс, растворимость, код...),
+        # - атрибуты класса; в самой клетке (__slots__, без __dict__) лежит только то, что у нее может
+        # поменяться: цвет, вес и прочность (их меняет заморозка) и состояние вроде burning или temperature.
         class Object:
+            __slots__ = ("color", "weight", "durability", "freezed", "original_color", "original_weight",
+                         "original_durability", "shared")
+            cls = None
+            type = None
+            code = None
+            soluble = None
+            can_be_freezed = None
+            # как двигается клетка (PHYSICS_MOBILITY) и флаги класса вместо сравнения строк cls
+            mobility = 0
+            ignitable = False
+            smoulders = False
+
             def __init__(self):
-                self.cls = None
-                self.type = None
                 self.color = None
                 self.weight = None
                 self.durability = None
-                self.soluble = None
-                self.can_be_freezed = None
                 self.freezed = False
                 self.original_color = None
                 self.original_weight = None
                 self.original_durability = None
+                self.shared = False
+
+            def __init_subclass__(cls):
+                cls.fields = tuple(name for klass in reversed(cls.__mro__[:-1]) for name in klass.__slots__)
+                # код материала - атрибут класса, так что он есть и у клеток, созданных мимо реестра
+                if cls.type is not None:
+                    cls.code = MATERIAL_CODES[cls.type]
+
+            def __copy__(self):
+                # copy.copy без copyreg: у клетки заполнены все слоты, их и переносим
+                cell = object.__new__(type(self))
+                for name in self.fields:
+                    setattr(cell, name, getattr(self, name))
+                return cell
 
             def freeze(self):
                 self.original_color = self.color
@@ -703,401 +2853,608 @@ class Sandbox:
 
         # Типы веществ
         class Gas(Object):
+            __slots__ = ()
+            cls = "gas"
+            soluble = False
+            can_be_freezed = False
+            mobility = PHYSICS_MOBILITY["gas"]
+
             def __init__(self):
                 super().__init__()
-                self.cls = "gas"
-                self.soluble = False
                 self.durability = 1
-                self.can_be_freezed = False
 
         class Falling(Object):
+            __slots__ = ()
+            cls = "falling"
+            mobility = PHYSICS_MOBILITY["falling"]
+
             def __init__(self):
                 super().__init__()
                 self.durability = 1
-                self.cls = "falling"
 
         class Liquid(Object):
+            __slots__ = ()
+            cls = "liquid"
+            soluble = False
+            mobility = PHYSICS_MOBILITY["liquid"]
+
             def __init__(self):
                 super().__init__()
-                self.cls = "liquid"
                 self.durability = 1
-                self.soluble = False
 
         class Solid(Object):
+            __slots__ = ()
+            cls = "solid"
+
             def __init__(self):
                 super().__init__()
-                self.cls = "solid"
                 self.durability = 1
 
         class Special(Object):
-            def __init__(self):
-                super().__init__()
-                self.cls = "special"
+            __slots__ = ()
+            cls = "special"
 
+        # горючие: ignitable - может загореться, smoulders - горит на месте (тлеет и гаснет без воздуха)
         class IgnitableL(Liquid):
+            __slots__ = ("burning",)
+            cls = "ignitable_liquid"
+            ignitable = True
+            extinct_chance = 0
+
             def __init__(self):
                 super().__init__()
-                self.cls = "ignitable_liquid"
-                self.durability = 1
-                self.soluble = False
                 self.burning = False
-                self.extinct_chance = 0
 
             def burn(self):
                 self.burning = True
 
-            def fade(self):
+            def fade(self, rnd=random):
                 self.burning = False
 
         class IgnitableS(Solid):
+            __slots__ = ("burning",)
+            cls = "ignitable_solid"
+            ignitable = True
+            smoulders = True
+            extinct_chance = 0
+
             def __init__(self):
                 super().__init__()
-                self.cls = "ignitable_solid"
-                self.durability = 1
-                self.soluble = None
                 self.burning = False
-                self.extinct_chance = 0
 
             def burn(self):
                 self.burning = True
 
-            def fade(self):
+            def fade(self, rnd=random):
                 self.burning = False
 
         class IgnitableF(Falling):
+            __slots__ = ("burning",)
+            cls = "ignitable_falling"
+            ignitable = True
+            smoulders = True
+            extinct_chance = 0
+
             def __init__(self):
                 super().__init__()
-                self.cls = "ignitable_falling"
-                self.durability = 1
-                self.soluble = None
                 self.burning = False
-                self.extinct_chance = 0
 
             def burn(self):
                 self.burning = True
 
-            def fade(self):
+            def fade(self, rnd=random):
                 self.burning = False
 
         # Основные вещества
         class Air(Gas):
+            __slots__ = ()
+            type = "air"
+
             def __init__(self):
                 super().__init__()
-                self.type = "air"
-                self.color = [0, 0, 0]
+                self.color = (0, 0, 0)
                 self.weight = -10
                 self.durability = 0
-                self.can_be_freezed = False
 
         class Sand(Falling):
+            __slots__ = ()
+            type = "sand"
+            soluble = False
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "sand"
                 self.color = approximate_color(200, 200, 100, 10)
                 self.weight = 10
-                self.durability = 1
-                self.soluble = False
-                self.can_be_freezed = True
 
         class Water(Liquid):
+            __slots__ = ()
+            type = "water"
+            can_be_freezed = False
+
             def __init__(self):
                 super().__init__()
-                self.type = "water"
                 self.color = approximate_color(30, 30, 200, 10)
                 self.weight = 7
                 self.durability = 3
-                self.can_be_freezed = False
 
         class Iron(Solid):
+            __slots__ = ()
+            type = "iron"
+            soluble = True
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "iron"
                 self.color = approximate_color(173, 173, 173, 2)
                 self.weight = 20
                 self.durability = 3
-                self.soluble = True
-                self.can_be_freezed = True
 
         class Vapor(Gas):
+            __slots__ = ()
+            type = "vapor"
+
             def __init__(self):
                 super().__init__()
-                self.type = "vapor"
                 self.color = approximate_color(222, 222, 222, 3)
                 self.weight = -11
-                self.durability = 1
 
         class Fire(Special):
+            __slots__ = ("temperature",)
+            type = "fire"
+            soluble = False
+            can_be_freezed = False
+
             def __init__(self, temperature):
                 super().__init__()
-                self.type = "fire"
-                self.color = [222, 89, 22]
+                self.color = (222, 89, 22)
                 self.weight = -100
-                self.temperature = temperature
-                self.soluble = False
                 self.durability = 1
-                self.can_be_freezed = False
+                self.temperature = temperature
 
             def fade(self):
                 self.temperature -= 1
-                self.color = gradient_color([222, 89, 22], [61, 12, 12], self.temperature * 20)
+                self.color = gradient_color((222, 89, 22), (61, 12, 12), self.temperature * 20)
 
         class Acid(Liquid):
+            __slots__ = ()
+            type = "acid"
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "acid"
                 self.color = approximate_color(130, 227, 27, 10)
                 self.weight = 7
                 self.durability = 3
-                self.can_be_freezed = True
 
         class AVapor(Gas):
+            __slots__ = ()
+            type = "acid_vapor"
+
             def __init__(self):
                 super().__init__()
-                self.type = "acid_vapor"
                 self.color = approximate_color(145, 235, 154, 3)
                 self.weight = -11
-                self.durability = 1
 
         class Dirt(Falling):
+            __slots__ = ()
+            type = "dirt"
+            soluble = True
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "dirt"
                 self.color = approximate_color(105, 39, 10, 5)
                 self.weight = 10
-                self.durability = 1
-                self.soluble = True
-                self.can_be_freezed = True
 
         class Oil(IgnitableL):
+            __slots__ = ()
+            type = "oil"
+            extinct_chance = 20
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "oil"
                 self.color = approximate_color(25, 22, 31, 1)
                 self.weight = 6
-                self.durability = 1
-                self.extinct_chance = 20
-                self.can_be_freezed = True
 
             def burn(self):
                 super().burn()
-                self.color = [252, 228, 167]
+                self.color = (252, 228, 167)
 
-            def fade(self):
+            def fade(self, rnd=random):
                 super().fade()
-                self.color = approximate_color(25, 22, 31, 2)
+                self.color = approximate_color(25, 22, 31, 2, rnd)
 
         class Wood(IgnitableS):
+            __slots__ = ()
+            type = "wood"
+            extinct_chance = 110
+            soluble = True
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "wood"
                 self.color = approximate_color(101, 67, 33, 2)
                 self.weight = 20
                 self.durability = 2
-                self.extinct_chance = 110
-                self.soluble = True
-                self.can_be_freezed = True
 
-            def random_burning_color(self):
-                self.color = approximate_color(20, 14, 11, 10)
+            def random_burning_color(self, rnd=random):
+                self.color = approximate_color(20, 14, 11, 10, rnd)
 
         class Coal(IgnitableS):
+            __slots__ = ()
+            type = "coal"
+            extinct_chance = 200
+            soluble = True
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "coal"
                 self.color = approximate_color(15, 14, 23, 2)
                 self.weight = 20
                 self.durability = 2
-                self.extinct_chance = 200
-                self.soluble = True
-                self.can_be_freezed = True
 
-            def random_burning_color(self):
-                self.color = approximate_color(56, 50, 45, 10)
+            def random_burning_color(self, rnd=random):
+                self.color = approximate_color(56, 50, 45, 10, rnd)
 
         class Salt(Falling):
+            __slots__ = ()
+            type = "salt"
+            soluble = True
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "salt"
                 self.color = approximate_color(237, 237, 237, 15)
                 self.weight = 10
-                self.durability = 1
-                self.soluble = True
-                self.can_be_freezed = True
 
         class SWater(Liquid):
+            __slots__ = ()
+            type = "salt_water"
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "salt_water"
                 self.color = approximate_color(84, 92, 176, 10)
                 self.weight = 8
                 self.durability = 3
-                self.can_be_freezed = True
 
         class Ice(Solid):
+            __slots__ = ()
+            type = "ice"
+            soluble = False
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "ice"
                 self.color = approximate_color(47, 133, 204, 1)
                 self.weight = 20
                 self.durability = 2
-                self.soluble = False
-                self.can_be_freezed = True
 
         class Snow(Falling):
+            __slots__ = ()
+            type = "snow"
+            soluble = False
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "snow"
                 self.color = approximate_color(171, 196, 217, 4)
                 self.weight = 6
                 self.durability = 2
-                self.soluble = False
-                self.can_be_freezed = True
 
         class Gunpowder(Falling):
+            __slots__ = ()
+            type = "gunpowder"
+            soluble = True
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "gunpowder"
                 self.color = approximate_color(36, 37, 38, 3)
                 self.weight = 10
-                self.durability = 1
-                self.soluble = True
-                self.can_be_freezed = True
 
         class ExplosionWave(Special):
+            __slots__ = ("power", "range", "life_tick")
+            type = "explosion_wave"
+            soluble = False
+            can_be_freezed = False
+
             def __init__(self, power, range):
                 super().__init__()
-                self.type = "explosion_wave"
                 self.weight = 20
                 self.durability = 1000
-                self.soluble = False
                 self.power = power
                 self.range = range
                 self.color = gradient_color((255, 106, 0), (0, 0, 0), self.range * 25)
                 self.life_tick = 2
-                self.can_be_freezed = False
 
             def fade(self):
                 self.life_tick -= 1
 
         class Sawdust(IgnitableF):
+            __slots__ = ()
+            type = "sawdust"
+            soluble = True
+            extinct_chance = 70
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "sawdust"
                 self.color = approximate_color(179, 104, 20, 4)
                 self.weight = 10
-                self.durability = 1
-                self.soluble = True
-                self.extinct_chance = 70
-                self.can_be_freezed = True
 
-            def random_burning_color(self):
-                self.color = approximate_color(20, 14, 11, 10)
+            def random_burning_color(self, rnd=random):
+                self.color = approximate_color(20, 14, 11, 10, rnd)
 
         class Methane(Gas):
+            __slots__ = ()
+            type = "methane"
+
             def __init__(self):
                 super().__init__()
-                self.type = "methane"
                 self.color = approximate_color(26, 26, 26, 3)
                 self.weight = -11
-                self.durability = 1
 
         class Wick(Solid):
+            __slots__ = ("activated",)
+            type = "wick"
+            soluble = True
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "wick"
                 self.color = approximate_color(7, 61, 19, 4)
                 self.weight = 20
-                self.durability = 1
-                self.soluble = True
                 self.activated = False
-                self.can_be_freezed = True
 
-            def activate(self):
+            def activate(self, rnd=random):
                 self.activated = True
-                self.color = approximate_color(245, 110, 0, 5)
+                self.color = approximate_color(245, 110, 0, 5, rnd)
 
         class LNitrogen(Liquid):
+            __slots__ = ()
+            type = "liquid_nitrogen"
+            can_be_freezed = False
+
             def __init__(self):
                 super().__init__()
-                self.type = "liquid_nitrogen"
                 self.color = approximate_color(210, 236, 247, 10)
                 self.weight = 7
                 self.durability = 3
-                self.can_be_freezed = False
 
         class Nitrogen(Gas):
+            __slots__ = ()
+            type = "nitrogen"
+
             def __init__(self):
                 super().__init__()
-                self.type = "nitrogen"
                 self.color = approximate_color(210, 236, 247, 3)
                 self.weight = -11
-                self.durability = 1
 
         class Wax(Solid):
+            __slots__ = ()
+            type = "wax"
+            soluble = True
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "wax"
                 self.color = approximate_color(214, 193, 161, 4)
                 self.weight = 20
-                self.durability = 1
-                self.soluble = True
-                self.can_be_freezed = True
 
         class LWax(Liquid):
+            __slots__ = ()
+            type = "liquid_wax"
+            soluble = True
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "liquid_wax"
                 self.color = approximate_color(255, 230, 191, 4)
                 self.weight = 7
-                self.durability = 1
-                self.soluble = True
-                self.can_be_freezed = True
 
         class Stone(Solid):
+            __slots__ = ()
+            type = "stone"
+            soluble = True
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "stone"
                 self.color = approximate_color(55, 63, 67, 4)
                 self.weight = 20
                 self.durability = 2
-                self.soluble = True
-                self.can_be_freezed = True
 
         class StrongFire(Special):
+            __slots__ = ("temperature",)
+            type = "strong_fire"
+            soluble = False
+            can_be_freezed = False
+
             def __init__(self, temperature):
                 super().__init__()
-                self.type = "strong_fire"
-                self.color = [30, 144, 255]
+                self.color = (30, 144, 255)
                 self.weight = -100
-                self.temperature = temperature
-                self.soluble = False
                 self.durability = 1
-                self.can_be_freezed = False
+                self.temperature = temperature
 
             def fade(self):
                 self.temperature -= 1
-                self.color = gradient_color([30, 144, 255], [12, 16, 61], self.temperature * 20)
+                self.color = gradient_color((30, 144, 255), (12, 16, 61), self.temperature * 20)
 
         class Lava(Liquid):
+            __slots__ = ()
+            type = "lava"
+            soluble = False
+            can_be_freezed = False
+
             def __init__(self):
                 super().__init__()
-                self.type = "lava"
                 self.color = approximate_color(227, 95, 0, 10)
                 self.weight = 9
-                self.durability = 1
-                self.soluble = False
-                self.can_be_freezed = False
 
         class Tnt(Solid):
+            __slots__ = ()
+            type = "tnt"
+            soluble = True
+            can_be_freezed = True
+
             def __init__(self):
                 super().__init__()
-                self.type = "tnt"
                 self.color = approximate_color(166, 17, 17, 1)
                 self.weight = 20
-                self.durability = 1
-                self.soluble = True
-                self.can_be_freezed = True
 
 
-sandbox = Sandbox()
-sandbox.run_game()
+MATERIAL_REGISTRY = MaterialRegistry()
+
+
+def load_scene(board, path):
+    # Сцена - текстовый файл, каждая строка: "<material_id> <x> <y> [<ширина> <высота>]",
+    # строки с # - комментарии. Прямоугольники заливаются по порядку.
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.split("#")[0].split()
+            if not line:
+                continue
+            x, y, width, height = (list(map(int, line[1:])) + [1, 1])[:4]
+            board.fill(x, y, width, height, line[0])
+
+
+def simulate(args):
+    # симуляция без окна, звука и ограничения fps: только tick_board так быстро, как получится
+    board = (GridBoard if args.engine == "grid" else Board)(args.width, args.height, args.seed)
+    if args.load:
+        board.load(args.load)
+    if args.scene:
+        load_scene(board, args.scene)
+    if args.workers:
+        board.set_workers(args.workers, args.seed)
+    board.set_profiler(args.profile)
+    start = time.perf_counter()
+    for _ in range(args.ticks):
+        board.tick_board()
+    elapsed = time.perf_counter() - start
+    if args.workers:
+        board.set_workers(0)
+    if args.save:
+        board.save(args.save)
+    print(f"{args.ticks} тиков на поле {board.width}x{board.height} ({args.engine}) за {elapsed:.2f} с: "
+          f"{args.ticks / elapsed if elapsed else float('inf'):.1f} тиков/с")
+    if board.profiler is not None:
+        print(f"последние {len(board.profiler.history)} тиков:")
+        for line in board.profiler.lines():
+            print("  " + line)
+
+
+def replay(args):
+    # повтор журнала ввода без окна и на полной скорости: те же seed, поле и ввод на тех же тиках
+    header, journal = read_journal(args.journal)
+    board = (GridBoard if header["engine"] == "grid" else Board)(header["width"], header["height"], header["seed"])
+    if header["workers"]:
+        board.set_workers(header["workers"])
+    # камера та же, что была в игре: от нее зависит, какие чанки тикают реже
+    board.set_view(0, 0, board.cell_size, header["view_width"], header["view_height"])
+    board.set_profiler(args.profile)
+    start = time.perf_counter()
+    for tick, action, cell, material, brush in journal:
+        # пока поле на паузе, тики не идут, и все действия паузы записаны с одним номером тика
+        while board.ticks < tick and not board.pause:
+            board.tick_board()
+        board.apply_input(action, cell, material, brush)
+    while board.ticks < header["ticks"] and not board.pause:
+        board.tick_board()
+    elapsed = time.perf_counter() - start
+    if header["workers"]:
+        board.set_workers(0)
+    if args.save:
+        board.save(args.save)
+    print(f"{board.ticks} тиков и {len(journal)} действий на поле {board.width}x{board.height} "
+          f"({header['engine']}, seed {header['seed']}) за {elapsed:.2f} с: "
+          f"{board.ticks / elapsed if elapsed else float('inf'):.1f} тиков/с")
+    if board.profiler is not None:
+        print(f"последние {len(board.profiler.history)} тиков:")
+        for line in board.profiler.lines():
+            print("  " + line)
+
+
+def board_size(text):
+    # размер поля для --size: "<ширина>x<высота>", обе стороны - целые больше нуля
+    try:
+        width, height = map(int, text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"размер должен быть вида 50x42, а не {text!r}")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"стороны поля должны быть больше нуля: {text!r}")
+    return width, height
+
+
+def positive_int(text):
+    # для --tps: шаг тика считается как 1 / tps, так что ноль и отрицательные значения не годятся
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"нужно целое число, а не {text!r}")
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"значение должно быть больше нуля: {text!r}")
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="DiversityBox")
+    commands = parser.add_subparsers(dest="command")
+    play = commands.add_parser("play", help="запустить игру (по умолчанию)")
+    play.add_argument("--engine", choices=["objects", "grid"], default="objects")
+    play.add_argument("--render", choices=["full", "dirty", "pixels"], default="full")
+    play.add_argument("--workers", type=int, default=0)
+    play.add_argument("--seed", type=int)
+    play.add_argument("--profile", action="store_true", help="замеры тика по фазам (переключается клавишей F3)")
+    play.add_argument("--kernels", choices=KERNEL_BACKENDS, default="auto", help="бэкенд ядер тика")
+    play.add_argument("--record", help="записать журнал ввода в файл (для replay)")
+    play.add_argument("--fps", type=int, default=60, help="предел кадров в секунду")
+    play.add_argument("--tps", type=positive_int, default=30, help="тиков поля в секунду")
+    play.add_argument("--background", action="store_true", help="поле тикает в отдельном процессе")
+    play.add_argument("--size", type=board_size, default="50x42",
+                      help="размер поля в клетках; большое поле смотрится через камеру")
+    headless = commands.add_parser("simulate", help="симуляция без окна с замером скорости")
+    headless.add_argument("--engine", choices=["objects", "grid"], default="grid")
+    headless.add_argument("--width", type=int, default=50)
+    headless.add_argument("--height", type=int, default=42)
+    headless.add_argument("--ticks", type=int, default=1000)
+    headless.add_argument("--scene")
+    headless.add_argument("--load", help="начать со снимка поля (размер берется из снимка)")
+    headless.add_argument("--save", help="в конце сохранить поле в снимок")
+    headless.add_argument("--workers", type=int, default=0)
+    headless.add_argument("--seed", type=int)
+    headless.add_argument("--profile", action="store_true", help="в конце напечатать замеры тика по фазам")
+    headless.add_argument("--kernels", choices=KERNEL_BACKENDS, default="auto", help="бэкенд ядер тика")
+    repeat = commands.add_parser("replay", help="повторить журнал ввода без окна с замером скорости")
+    repeat.add_argument("journal")
+    repeat.add_argument("--save", help="в конце сохранить поле в снимок")
+    repeat.add_argument("--profile", action="store_true", help="в конце напечатать замеры тика по фазам")
+    repeat.add_argument("--kernels", choices=KERNEL_BACKENDS, default="auto", help="бэкенд ядер тика")
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in list(commands.choices) + ["-h", "--help"]:
+        argv = ["play"] + argv
+    args = parser.parse_args(argv)
+    # параллельный тик есть только у сеточного движка
+    if args.command != "replay" and args.workers and args.engine != "grid":
+        commands.choices[args.command].error("--workers работает только с --engine grid")
+    set_kernels(args.kernels)
+
+    if args.command == "simulate":
+        simulate(args)
+        return
+    if args.command == "replay":
+        replay(args)
+        return
+    if sys.platform == "win32":
+        ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
+    sandbox = Sandbox(args.engine, args.render, args.workers, args.seed, args.profile, args.record, args.fps, args.tps,
+                      args.background, args.size)
+    sandbox.run_game()
+
+
+if __name__ == "__main__":
+    main()
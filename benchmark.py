@@ -0,0 +1,258 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pygame
+
+import DiversityBox
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SIZES = ["50x42", "200x150", "400x300", "1024x1024"]
+# метрики, рост которых считается регрессией
+COMPARED = ["ms_per_tick", "render_ms"]
+
+
+def fill(board, material_id, x0, y0, x1, y1):
+    # прямоугольник в долях ширины и высоты поля, чтобы сцены одинаково выглядели на любом размере
+    x, y = int(x0 * board.width), int(y0 * board.height)
+    board.fill(x, y, max(1, int(x1 * board.width) - x), max(1, int(y1 * board.height) - y), material_id)
+
+
+def sand_pile(board):
+    fill(board, "stone", 0, 0.95, 1, 1)
+    fill(board, "sand", 0.3, 0.05, 0.7, 0.5)
+
+
+def water_pool(board):
+    fill(board, "stone", 0, 0.95, 1, 1)
+    fill(board, "stone", 0.1, 0.5, 0.12, 0.95)
+    fill(board, "stone", 0.88, 0.5, 0.9, 0.95)
+    fill(board, "water", 0.15, 0.1, 0.85, 0.6)
+
+
+def oil_fire(board):
+    fill(board, "stone", 0, 0.95, 1, 1)
+    fill(board, "oil", 0.1, 0.6, 0.9, 0.95)
+    fill(board, "wood", 0.4, 0.3, 0.6, 0.6)
+    fill(board, "fire_5", 0.1, 0.55, 0.9, 0.6)
+
+
+def tnt_chain(board):
+    fill(board, "stone", 0, 0.95, 1, 1)
+    for k in range(5):
+        fill(board, "tnt", 0.1 + k * 0.17, 0.5, 0.2 + k * 0.17, 0.95)
+        fill(board, "gunpowder", 0.2 + k * 0.17, 0.85, 0.27 + k * 0.17, 0.95)
+    fill(board, "wick", 0.02, 0.3, 0.04, 0.95)
+    fill(board, "fire_5", 0.02, 0.28, 0.04, 0.3)
+
+
+def lava_stone(board):
+    fill(board, "stone", 0, 0.6, 1, 1)
+    fill(board, "lava", 0.2, 0.1, 0.8, 0.5)
+
+
+def nitrogen_freeze(board):
+    fill(board, "stone", 0, 0.95, 1, 1)
+    fill(board, "water", 0, 0.6, 1, 0.95)
+    fill(board, "liquid_nitrogen", 0.3, 0.1, 0.7, 0.3)
+
+
+SCENES = {"sand_pile": sand_pile, "water_pool": water_pool, "oil_fire": oil_fire, "tnt_chain": tnt_chain,
+          "lava_stone": lava_stone, "nitrogen_freeze": nitrogen_freeze}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_case(scene, size, engine, ticks, render_mode, seed):
+    width, height = map(int, size.split("x"))
+    board = (DiversityBox.GridBoard if engine == "grid" else DiversityBox.Board)(width, height, seed)
+    SCENES[scene](board)
+    cell_size = max(1, 1024 // max(width, height))
+    board.set_view(0, 0, cell_size)
+    board.set_render_mode(render_mode)
+    surf = pygame.Surface((width * cell_size, height * cell_size))
+    # первый тик без замера: numba компилирует (или грузит из кэша) ядра, рендер заводит свои поверхности
+    board.tick_board()
+    board.render(surf)
+
+    tick_times, render_times = [], []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        board.tick_board()
+        tick_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        board.render(surf)
+        render_times.append(time.perf_counter() - start)
+
+    # память, выделяемая за тик (пик внутри тика относительно начала), на нескольких отдельных тиках
+    tracemalloc.start()
+    allocated = []
+    for _ in range(min(ticks, 5)):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        board.tick_board()
+        allocated.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+
+    return {"scene": scene, "size": size, "engine": engine, "render": render_mode, "ticks": ticks,
+            "ticks_per_s": round(ticks / sum(tick_times), 2),
+            "ms_per_tick": round(1000 * sum(tick_times) / ticks, 3),
+            "ms_per_tick_max": round(1000 * max(tick_times), 3),
+            "render_ms": round(1000 * sum(render_times) / ticks, 3),
+            "alloc_kb_per_tick": round(float(np.mean(allocated)) / 1024, 1) if allocated else 0,
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def run(args):
+    # каждый случай идет в отдельном процессе, чтобы пиковая память не смешивалась между случаями
+    results = []
+    for engine in args.engines.split(","):
+        for size in args.sizes.split(","):
+            for scene in args.scenes.split(","):
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), "case", scene, size, engine,
+                                         "--ticks", str(args.ticks), "--render", args.render,
+                                         "--seed", str(args.seed), "--kernels", args.kernels],
+                                        capture_output=True, text=True, check=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                results.append(result)
+                print(f"{engine:7} {size:>9} {scene:16} {result['ticks_per_s']:9.2f} тиков/с "
+                      f"{result['ms_per_tick']:9.2f} мс/тик  рендер {result['render_ms']:7.2f} мс", file=sys.stderr)
+    report = {"meta": {"python": platform.python_version(), "numpy": np.__version__,
+                       "platform": platform.platform(), "processor": platform.processor(),
+                       "date": time.strftime("%Y-%m-%d %H:%M:%S")},
+              "results": results}
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as file:
+            file.write(text)
+    else:
+        print(text)
+
+
+def compare(args):
+    # сравнение двух отчетов: регрессия - метрика выросла больше, чем на threshold процентов
+    with open(args.base, encoding="utf-8") as file:
+        base = {(r["scene"], r["size"], r["engine"]): r for r in json.load(file)["results"]}
+    with open(args.new, encoding="utf-8") as file:
+        new = {(r["scene"], r["size"], r["engine"]): r for r in json.load(file)["results"]}
+    regressions = 0
+    for key in sorted(base.keys() & new.keys()):
+        for metric in COMPARED:
+            old_value, new_value = base[key][metric], new[key][metric]
+            change = (new_value - old_value) / old_value * 100 if old_value else 0
+            flag = ""
+            if change > args.threshold:
+                flag = "  <-- РЕГРЕССИЯ"
+                regressions += 1
+            print(f"{key[2]:7} {key[1]:>9} {key[0]:16} {metric:12} {old_value:10.3f} -> {new_value:10.3f} "
+                  f"({change:+.1f}%){flag}")
+    print(f"регрессий: {regressions}")
+    return 1 if regressions else 0
+
+
+def kernel_run(scene, size, engine, ticks, seed, backend):
+    # один прогон сцены на выбранных ядрах: все поля клеток, гистограмма материалов и статистика реакций
+    DiversityBox.set_kernels(backend)
+    width, height = map(int, size.split("x"))
+    board = (DiversityBox.GridBoard if engine == "grid" else DiversityBox.Board)(width, height, seed)
+    SCENES[scene](board)
+    board.profiler = DiversityBox.TickProfiler(window=ticks)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        board.tick_board()
+    elapsed = time.perf_counter() - start
+    stats = board.profiler.stats()
+    fields = board.cell_arrays()
+    return {"fields": fields, "histogram": board.population.sum((0, 1)).tolist(),
+            "reactions": stats["reactions"], "replaced": stats["replaced"], "ms_per_tick": 1000 * elapsed / ticks}
+
+
+def check_kernels(args):
+    # Проверка бэкендов ядер тика: одни и те же сцены с одним seed на эталонных ядрах numpy и на ядрах
+    # numba должны дать одно и то же поле клетка в клетку, те же гистограммы материалов и те же реакции.
+    # Без numba сравниваются те же циклы без компиляции ("loops") - медленно, но логика проверяется та же.
+    other = "numba" if DiversityBox.numba is not None else "loops"
+    if other == "loops":
+        print("numba не установлена: вместо скомпилированных ядер проверяются те же циклы без компиляции",
+              file=sys.stderr)
+    mismatches = 0
+    for engine in args.engines.split(","):
+        for scene in args.scenes.split(","):
+            for seed in range(args.seeds):
+                base = kernel_run(scene, args.size, engine, args.ticks, seed, "numpy")
+                if other == "numba":
+                    # первый прогон компилирует ядра, его время не показательно
+                    kernel_run(scene, args.size, engine, 1, seed, other)
+                result = kernel_run(scene, args.size, engine, args.ticks, seed, other)
+                problems = [name for name in ("histogram", "reactions", "replaced") if base[name] != result[name]]
+                problems += [name for name in base["fields"] if not np.array_equal(base["fields"][name],
+                                                                                   result["fields"][name])]
+                mismatches += bool(problems)
+                print(f"{engine:7} {scene:16} seed {seed}  numpy {base['ms_per_tick']:8.2f} мс/тик  "
+                      f"{other} {result['ms_per_tick']:8.2f} мс/тик  "
+                      f"{'РАСХОЖДЕНИЕ: ' + ', '.join(problems) if problems else 'совпадает'}")
+    print(f"расхождений: {mismatches}")
+    return 1 if mismatches else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="прогнать сцены и записать отчет в JSON")
+    run_parser.add_argument("--scenes", default=",".join(SCENES))
+    run_parser.add_argument("--sizes", default=",".join(SIZES))
+    run_parser.add_argument("--engines", default="grid")
+    run_parser.add_argument("--ticks", type=int, default=30)
+    run_parser.add_argument("--render", choices=["full", "dirty", "pixels"], default="pixels")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--kernels", choices=DiversityBox.KERNEL_BACKENDS, default="auto")
+    run_parser.add_argument("--out")
+    case_parser = commands.add_parser("case", help="один случай (запускается из run)")
+    case_parser.add_argument("scene", choices=list(SCENES))
+    case_parser.add_argument("size")
+    case_parser.add_argument("engine", choices=["objects", "grid"])
+    case_parser.add_argument("--ticks", type=int, default=30)
+    case_parser.add_argument("--render", choices=["full", "dirty", "pixels"], default="pixels")
+    case_parser.add_argument("--seed", type=int, default=0)
+    case_parser.add_argument("--kernels", choices=DiversityBox.KERNEL_BACKENDS, default="auto")
+    compare_parser = commands.add_parser("compare", help="сравнить два отчета и найти регрессии")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=10)
+    kernels_parser = commands.add_parser("kernels", help="сравнить бэкенды ядер тика на одних и тех же сценах")
+    kernels_parser.add_argument("--scenes", default=",".join(SCENES))
+    kernels_parser.add_argument("--size", default="64x48")
+    kernels_parser.add_argument("--engines", default="objects,grid")
+    kernels_parser.add_argument("--ticks", type=int, default=30)
+    kernels_parser.add_argument("--seeds", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        run(args)
+    elif args.command == "case":
+        DiversityBox.set_kernels(args.kernels)
+        print(json.dumps(run_case(args.scene, args.size, args.engine, args.ticks, args.render, args.seed)))
+    elif args.command == "kernels":
+        sys.exit(check_kernels(args))
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
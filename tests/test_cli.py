@@ -0,0 +1,40 @@
+import argparse
+
+import pytest
+
+import DiversityBox
+
+
+def test_board_size():
+    assert DiversityBox.board_size("50x42") == (50, 42)
+    assert DiversityBox.board_size("400X300") == (400, 300)
+
+
+@pytest.mark.parametrize("text", ["100", "0x0", "-5x4", "axb", "3x4x5"])
+def test_bad_board_size_is_an_argparse_error(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        DiversityBox.board_size(text)
+    with pytest.raises(SystemExit):
+        DiversityBox.main(["play", "--size", text])
+
+
+@pytest.mark.parametrize("text", ["0", "-30", "fast"])
+def test_bad_tps_is_an_argparse_error(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        DiversityBox.positive_int(text)
+    with pytest.raises(SystemExit) as error:
+        DiversityBox.main(["play", "--tps", text])
+    assert error.value.code == 2
+
+
+@pytest.mark.parametrize("command", ["play", "simulate"])
+def test_workers_need_grid_engine(command, capsys):
+    with pytest.raises(SystemExit) as error:
+        DiversityBox.main([command, "--engine", "objects", "--workers", "2"])
+    assert error.value.code == 2
+    assert "--engine grid" in capsys.readouterr().err
+
+
+def test_simulate_grid_with_workers(capsys):
+    DiversityBox.main(["simulate", "--engine", "grid", "--workers", "2", "--ticks", "5", "--kernels", "numpy"])
+    assert "5 тиков" in capsys.readouterr().out
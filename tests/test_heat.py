@@ -0,0 +1,42 @@
+import pytest
+
+import DiversityBox
+
+
+@pytest.mark.parametrize("engine", [DiversityBox.Board, DiversityBox.GridBoard])
+def test_lava_in_air_stays_lava(engine):
+    # лава сама держит свое тепло: в воздухе она не остывает до камня, это делают только криогенные источники
+    board = engine(30, 30, 0)
+    board.fill(5, 5, 1, 1, "lava")
+    board.fill(15, 5, 6, 4, "lava")
+    for _ in range(40):
+        board.tick_board()
+        assert board.count("stone") == 0
+    assert board.count("lava") == 25
+
+
+@pytest.mark.parametrize("engine", [DiversityBox.Board, DiversityBox.GridBoard])
+def test_liquid_nitrogen_turns_lava_to_stone(engine):
+    board = engine(30, 30, 0)
+    board.fill(0, 20, 30, 10, "lava")
+    board.fill(5, 10, 20, 5, "liquid_nitrogen")
+    for _ in range(20):
+        board.tick_board()
+    assert board.count("stone") > 0
+
+
+@pytest.mark.parametrize("engine", [DiversityBox.Board, DiversityBox.GridBoard])
+def test_heat_reaches_sleeping_chunks(engine):
+    # лава за стенкой из железа на границе чанков; вода по другую сторону успела заснуть
+    board = engine(64, 32, 0)
+    board.fill(0, 30, 64, 2, "stone")
+    board.fill(31, 0, 1, 30, "iron")
+    board.fill(32, 20, 32, 10, "water")
+    for _ in range(60):
+        board.tick_board()
+    assert not board.awake[:, 2:].any()
+    board.fill(0, 0, 31, 30, "lava")
+    for _ in range(80):
+        board.tick_board()
+    assert board.heat[25, 32] > 100
+    assert board.count("vapor") > 0
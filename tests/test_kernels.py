@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import benchmark
+import DiversityBox
+
+SEEDS = [0, 1]
+ENGINES = [DiversityBox.Board, DiversityBox.GridBoard]
+
+
+@pytest.fixture(autouse=True)
+def numpy_kernels():
+    yield
+    DiversityBox.set_kernels("numpy")
+
+
+def run(engine, scene, seed, backend, ticks=15):
+    # поля клеток, гистограмма материалов и реакции после ticks тиков сцены на выбранных ядрах
+    DiversityBox.set_kernels(backend)
+    board = engine(48, 32, seed)
+    benchmark.SCENES[scene](board)
+    board.profiler = DiversityBox.TickProfiler(window=ticks)
+    for _ in range(ticks):
+        board.tick_board()
+    stats = board.profiler.stats()
+    return board.cell_arrays(), board.population.sum((0, 1)).tolist(), stats["reactions"], stats["replaced"]
+
+
+def assert_same(base, other):
+    fields, histogram, reactions, replaced = base
+    assert other[1] == histogram
+    assert other[2] == reactions
+    assert other[3] == replaced
+    for name in fields:
+        assert np.array_equal(other[0][name], fields[name]), name
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("scene", list(benchmark.SCENES))
+@pytest.mark.parametrize("engine", ENGINES, ids=["objects", "grid"])
+def test_loop_kernels_match_numpy(engine, scene, seed):
+    # циклы без компиляции - та же логика, что numba компилирует
+    assert_same(run(engine, scene, seed, "numpy"), run(engine, scene, seed, "loops"))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("scene", list(benchmark.SCENES))
+@pytest.mark.parametrize("engine", ENGINES, ids=["objects", "grid"])
+def test_numba_kernels_match_numpy(engine, scene, seed):
+    pytest.importorskip("numba")
+    assert_same(run(engine, scene, seed, "numpy"), run(engine, scene, seed, "numba"))
+
+
+def test_blast_kernels_match_numpy():
+    # ядро взрывов на случайных полях: в сценах за несколько тиков взрыв может и не случиться
+    rng = np.random.default_rng(0)
+    kernels = [DiversityBox.spread_blasts_loops]
+    if DiversityBox.numba is not None:
+        kernels.append(DiversityBox.numba.njit(DiversityBox.spread_blasts_loops))
+    for _ in range(100):
+        h, w = rng.integers(1, 20, 2)
+        durability = rng.integers(0, 8, (h, w)).astype(np.int16)
+        power = np.where(rng.random((h, w)) < 0.05, rng.integers(1, 7, (h, w)), 0).astype(np.int16)
+        wave_range = rng.integers(0, 7, (h, w)).astype(np.int16)
+        reached, ranges = DiversityBox.spread_blasts(durability, power, wave_range)
+        for kernel in kernels:
+            other_reached, other_ranges = kernel(durability, power, wave_range)
+            assert np.array_equal(other_reached, reached)
+            assert np.array_equal(other_ranges, ranges)
+
+
+def test_missing_numba_falls_back_to_numpy(monkeypatch):
+    monkeypatch.setattr(DiversityBox, "numba", None)
+    assert DiversityBox.set_kernels("numba") == "numpy"
+    assert DiversityBox.set_kernels("auto") == "numpy"
+    assert DiversityBox.KERNELS["diffuse"] is DiversityBox.diffuse